@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# benchmarks for the hot paths of pynter.defects.analysis
+
+import os
+import sys
+import json
+import gc
+import time
+import platform
+import tracemalloc
+import argparse as ap
+import numpy as np
+from pymatgen.core.periodic_table import Element
+from pymatgen.electronic_structure.dos import CompleteDos
+from pynter.defects.analysis import SingleDefectData, DefectsAnalysis
+
+files_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','tutorials','defects_analysis','files')
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)),'baseline_defects_analysis.json')
+
+
+def load_tutorial_data():
+    """
+    Load the tutorial defect entries, DOS and chemical potentials (NaNbO3, R3 phase, PBE).
+    """
+    with open(os.path.join(files_dir,'defects_analysis_vacancies-PBE-R3.json')) as file:
+        da = DefectsAnalysis.from_dict(json.load(file))
+    with open(os.path.join(files_dir,'dos_NN_R3-_PBE.json')) as file:
+        bulk_dos = CompleteDos.from_dict(json.load(file))
+    with open(os.path.join(files_dir,'chempots_boundary_NN_R3-_PBE.json')) as file:
+        chempots = {r:{Element(el):mu for el,mu in mus.items()} for r,mus in json.load(file).items()}
+    return da, bulk_dos, chempots
+
+
+def get_synthetic_entries(da, size, seed=0):
+    """
+    Synthetic list of defect entries built from the tutorial entries. Every copy of the tutorial set
+    gets different names and energies randomly shifted (std 0.1 eV), so that the number of defect
+    names grows with the number of entries as in a real dataset. Bulk structures are shared.
+    """
+    rng = np.random.default_rng(seed)
+    entries = list(da.defect_entries)
+    synthetic = []
+    for i in range(size):
+        entry = entries[i % len(entries)]
+        synthetic.append(SingleDefectData(entry.bulk_structure,entry.delta_atoms,entry.energy_diff + rng.normal(0,0.1),
+                                          entry.corrections,entry.charge,entry.multiplicity,f'{entry.name}_{i // len(entries)}'))
+    return synthetic
+
+
+def get_benchmarks(bulk_dos, chempots):
+    """
+    Functions to benchmark, with a DefectsAnalysis object as argument.
+    """
+    mu = chempots['A']
+
+    def _non_equilibrium_fermi_level(da):
+        frozen = da.defect_concentrations_array(mu,1000,da.equilibrium_fermi_level(mu,bulk_dos,1000))[0]
+        return da.non_equilibrium_fermi_level(frozen,mu,bulk_dos,temperature=300)
+
+    benchmarks = {
+        'formation_energies': lambda da: da.formation_energies(mu,fermi_level=0.5),
+        'stable_charges': lambda da: da.stable_charges(mu,fermi_level=0.5),
+        'charge_transition_levels': lambda da: da.charge_transition_levels(),
+        'equilibrium_fermi_level': lambda da: da.equilibrium_fermi_level(mu,bulk_dos,temperature=1000),
+        'non_equilibrium_fermi_level': _non_equilibrium_fermi_level,
+        'plot_data': lambda da: da.formation_energy_envelopes(mu)
+        }
+    return benchmarks
+
+
+def run_benchmark(function, entries, vbm, band_gap, repeat=5):
+    """
+    Time a function on fresh DefectsAnalysis objects (caches are empty, entries are already packed).
+    Returns the best time over the repetitions in s and the peak memory allocated during one call in MB.
+    The garbage collector is disabled during the timings as in timeit.
+    """
+    times = []
+    for i in range(repeat):
+        da = DefectsAnalysis(entries,vbm,band_gap)
+        da.names()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function(da)
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    da = DefectsAnalysis(entries,vbm,band_gap)
+    da.names()
+    tracemalloc.start()
+    function(da)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(times), peak / 1e6
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Compare timings with the stored baseline. Returns the list of (benchmark,size,ratio) of the
+    timings slower than tolerance times the baseline.
+    """
+    regressions = []
+    for name,sizes in results.items():
+        for size,result in sizes.items():
+            if name in baseline and size in baseline[name]:
+                ratio = result['time'] / baseline[name][size]['time']
+                result['ratio'] = ratio
+                if ratio > tolerance:
+                    regressions.append((name,size,ratio))
+    return regressions
+
+
+def main():
+    parser = ap.ArgumentParser(description='Benchmarks for the hot paths of pynter.defects.analysis')
+    parser.add_argument('-s','--sizes',help='Number of defect entries of the synthetic datasets',nargs='+',type=int,
+                        default=[10,100,1000,10000])
+    parser.add_argument('-b','--benchmarks',help='Benchmarks to run (default all)',nargs='+',default=None)
+    parser.add_argument('-r','--repeat',help='Number of repetitions, the best time is reported',type=int,default=5)
+    parser.add_argument('--baseline',help='Path of the baseline json file',default=default_baseline)
+    parser.add_argument('--save-baseline',help='Store the results as new baseline',action='store_true')
+    parser.add_argument('-t','--tolerance',help='Max ratio with baseline timings before reporting a regression',
+                        type=float,default=2)
+    args = parser.parse_args()
+
+    da, bulk_dos, chempots = load_tutorial_data()
+    benchmarks = get_benchmarks(bulk_dos,chempots)
+    names = args.benchmarks if args.benchmarks else list(benchmarks)
+
+    results = {name:{} for name in names}
+    print(f'{"benchmark":<30}{"entries":>8}{"time (ms)":>12}{"entries/s":>14}{"peak (MB)":>12}')
+    for size in args.sizes:
+        entries = get_synthetic_entries(da,size)
+        for name in names:
+            seconds, peak = run_benchmark(benchmarks[name],entries,da.vbm,da.band_gap,repeat=args.repeat)
+            results[name][str(size)] = {'time':seconds,'throughput':size/seconds,'peak_memory':peak}
+            print(f'{name:<30}{size:>8}{seconds*1e3:>12.2f}{size/seconds:>14.3g}{peak:>12.2f}')
+
+    if args.save_baseline:
+        baseline = {
+            'metadata':{
+                'python':platform.python_version(),
+                'numpy':np.__version__,
+                'platform':platform.platform(),
+                'processor':platform.processor()
+                },
+            'results':results
+            }
+        with open(args.baseline,'w') as file:
+            json.dump(baseline,file,indent=2)
+        print(f'\nBaseline saved in {args.baseline}')
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print(f'\nBaseline file {args.baseline} not found, run with --save-baseline to create it')
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)['results']
+
+    regressions = compare_with_baseline(results,baseline,args.tolerance)
+    print(f'\n{"benchmark":<30}{"entries":>8}{"ratio to baseline":>20}')
+    for name,sizes in results.items():
+        for size,result in sizes.items():
+            if 'ratio' in result:
+                print(f'{name:<30}{size:>8}{result["ratio"]:>20.2f}')
+    if regressions:
+        print(f'\n{len(regressions)} regressions (slower than {args.tolerance} times the baseline):')
+        for name,size,ratio in regressions:
+            print(f'    {name} with {size} entries: {ratio:.2f} x baseline')
+        return 1
+
+    print('\nNo regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,21 @@
 # module for analysing defect calculations
 
 
+import io
+import json
+import os.path as op
 import numpy as np
-from scipy.optimize import bisect
+from collections import OrderedDict
 from pymatgen.analysis.defects.utils import kb
 from pymatgen.core.structure import Structure, PeriodicSite, Lattice
 from pymatgen.core.periodic_table import Element
-from pymatgen.electronic_structure.dos import FermiDos
 import matplotlib
 import matplotlib.pyplot as plt
-from pynter.defects.pmg_dos import FermiDosCarriersInfo
+from pynter.defects.pmg_dos import get_fermi_dos
+from pynter.defects.neutrality import (get_band_arrays, get_carriers_charge_array, get_defects_charge_array, get_total_log_charge,
+                                       solve_neutrality, solve_equilibrium_conditions, solve_non_equilibrium_conditions)
+from pynter.defects.parallel import run_sharded
+from pynter.tools.utils import iter_json_object, load_npz, save_npz
 
 class SingleDefectData:
     
@@ -162,11 +168,564 @@ class SingleDefectData:
         return conc
     
     
+class DefectEntrySet:
+
+    def __init__(self, bulk_structures, structure_indexes, elements, delta_atoms, energy_diffs, correction_types,
+                 corrections, charges, multiplicities, names, entry_names, defect_sites=None,
+                 delta_atoms_mask=None, corrections_mask=None):
+        """
+        Immutable set of defect entries stored as NumPy arrays (one row for each entry). Bulk structures
+        are stored only once and shared by the entries. Items of the set are DefectEntryRow objects,
+        lightweight views with the same interface of SingleDefectData.
+        Bulk structures and defect sites can also be given as dict representations, in which case they 
+        are converted to pymatgen objects only when accessed for the first time.
+        Most likely generated with from_entries() or from_dicts().
+
+        Parameters
+        ----------
+        bulk_structures : (list)
+            List of the different bulk structures (Structure objects or dicts).
+        structure_indexes : (ndarray)
+            Index in bulk_structures of the bulk structure of every entry.
+        elements : (list)
+            List of Element objects labelling the columns of delta_atoms.
+        delta_atoms : (ndarray)
+            Matrix (entries x elements) with the delta_atoms of every entry.
+        energy_diffs : (ndarray)
+            Difference btw energy of defect structure and energy of pure structure for every entry.
+        correction_types : (list)
+            List of the names of the corrections labelling the columns of corrections.
+        corrections : (ndarray)
+            Matrix (entries x correction types) with the corrections of every entry.
+        charges : (ndarray)
+            Charge of every entry. Stored as floats, integer charges are returned as int by the rows.
+        multiplicities : (ndarray)
+            Multiplicity of every entry.
+        names : (list)
+            List of the different names of the entries.
+        entry_names : (ndarray)
+            Index in names of the name of every entry.
+        defect_sites : (list), optional
+            Defect site (PeriodicSite, dict or None) of every entry. The default is None (no defect sites).
+        delta_atoms_mask : (ndarray), optional
+            Boolean matrix with the elements present in the delta_atoms dict of every entry.
+            The default is None (elements with non-zero delta_atoms).
+        corrections_mask : (ndarray), optional
+            Boolean matrix with the corrections present in the corrections dict of every entry.
+            The default is None (all correction types).
+        """
+        # the list is shared with the sets generated with select(), structures are converted only once
+        self._bulk_structures = bulk_structures if isinstance(bulk_structures,list) else list(bulk_structures)
+        self._structure_indexes = np.asarray(structure_indexes,dtype=int)
+        self._elements = list(elements)
+        self._delta_atoms = np.asarray(delta_atoms).reshape(len(self._structure_indexes),len(self._elements))
+        self._energy_diffs = np.asarray(energy_diffs,dtype=float)
+        self._correction_types = list(correction_types)
+        self._corrections = np.asarray(corrections,dtype=float).reshape(len(self._structure_indexes),len(self._correction_types))
+        self._charges = np.asarray(charges,dtype=float)
+        self._multiplicities = np.asarray(multiplicities)
+        self._names = list(names)
+        self._entry_names = np.asarray(entry_names,dtype=int)
+        self._defect_sites = list(defect_sites) if defect_sites else [None]*len(self._structure_indexes)
+        self._delta_atoms_mask = (np.asarray(delta_atoms_mask,dtype=bool) if delta_atoms_mask is not None
+                                  else self._delta_atoms != 0)
+        self._corrections_mask = (np.asarray(corrections_mask,dtype=bool) if corrections_mask is not None
+                                  else np.ones(self._corrections.shape,dtype=bool))
+
+        # arrays are exposed as read-only views
+        for array in (self._structure_indexes,self._delta_atoms,self._energy_diffs,self._corrections,self._charges,
+                      self._multiplicities,self._entry_names,self._delta_atoms_mask,self._corrections_mask):
+            array.flags.writeable = False
+
+        volumes = np.array([self._get_volume(structure) for structure in self._bulk_structures],dtype=float)
+        self._energies = self._energy_diffs + self._corrections.sum(axis=1)
+        self._site_densities = self._multiplicities * 1e24 / volumes[self._structure_indexes]
+        self._energies.flags.writeable = False
+        self._site_densities.flags.writeable = False
+
+
+    def __len__(self):
+        return len(self._structure_indexes)
+
+    def __iter__(self):
+        return (DefectEntryRow(self,i) for i in range(len(self)))
+
+    def __getitem__(self,index):
+        if isinstance(index,(int,np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('DefectEntrySet index out of range')
+            return DefectEntryRow(self,int(index))
+        else:
+            return self.select(np.arange(len(self))[index])
+
+    def __repr__(self):
+        return f'DefectEntrySet with {len(self)} entries, {len(self._names)} names and {len(self._bulk_structures)} bulk structures'
+
+    @property
+    def bulk_structures(self):
+        return [self.get_bulk_structure(i) for i in range(len(self._bulk_structures))]
+
+    @property
+    def structure_indexes(self):
+        return self._structure_indexes
+
+    @property
+    def elements(self):
+        return self._elements
+
+    @property
+    def delta_atoms(self):
+        return self._delta_atoms
+
+    @property
+    def delta_atoms_mask(self):
+        return self._delta_atoms_mask
+
+    @property
+    def energy_diffs(self):
+        return self._energy_diffs
+
+    @property
+    def correction_types(self):
+        return self._correction_types
+
+    @property
+    def corrections(self):
+        return self._corrections
+
+    @property
+    def corrections_mask(self):
+        return self._corrections_mask
+
+    @property
+    def charges(self):
+        return self._charges
+
+    @property
+    def multiplicities(self):
+        return self._multiplicities
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def entry_names(self):
+        return self._entry_names
+
+    @property
+    def defect_sites(self):
+        return [self.get_defect_site(i) for i in range(len(self))]
+
+    @property
+    def energies(self):
+        """
+        Energy difference plus the sum of the corrections of every entry.
+        """
+        return self._energies
+
+    @property
+    def site_densities(self):
+        """
+        Density of defect sites (multiplicity * 1e24 / volume of the bulk structure) in cm^-3 of every entry.
+        """
+        return self._site_densities
+
+
+    @staticmethod
+    def _get_volume(structure):
+        """
+        Volume of a Structure object or of its dict representation, without building the Structure.
+        """
+        if isinstance(structure,dict):
+            m = np.array(structure['lattice']['matrix'],dtype=float)
+            return abs(np.dot(np.cross(m[0],m[1]),m[2]))
+        return structure.volume
+
+
+    def get_bulk_structure(self,index):
+        """
+        Get the bulk structure with a given index in the list of bulk structures. 
+        If it is stored as a dict it is converted to a Structure object and kept.
+        """
+        if isinstance(self._bulk_structures[index],dict):
+            self._bulk_structures[index] = Structure.from_dict(self._bulk_structures[index])
+        return self._bulk_structures[index]
+
+
+    def get_defect_site(self,index):
+        """
+        Get the defect site of the entry with a given index. 
+        If it is stored as a dict it is converted to a PeriodicSite object and kept.
+        """
+        if isinstance(self._defect_sites[index],dict):
+            self._defect_sites[index] = PeriodicSite.from_dict(self._defect_sites[index])
+        return self._defect_sites[index]
+
+
+    @classmethod
+    def from_entries(cls,entries):
+        """
+        Build a DefectEntrySet from a list of SingleDefectData objects. Bulk structures that are the
+        same object or equal are stored only once.
+        """
+        bulk_structures = []
+        structure_positions = {}
+        structure_indexes = []
+        for entry in entries:
+            structure = entry.bulk_structure
+            if id(structure) not in structure_positions:
+                for i,s in enumerate(bulk_structures):
+                    if s == structure:
+                        structure_positions[id(structure)] = i
+                        break
+                else:
+                    structure_positions[id(structure)] = len(bulk_structures)
+                    bulk_structures.append(structure)
+            structure_indexes.append(structure_positions[id(structure)])
+
+        return cls._from_rows(entries,bulk_structures,structure_indexes)
+
+
+    @classmethod
+    def from_dicts(cls,dicts):
+        """
+        Build a DefectEntrySet from dict representations of SingleDefectData (see SingleDefectData.as_dict()).
+        Only the numeric fields are read, bulk structures and defect sites are stored as dicts 
+        and converted when accessed. Bulk structures with equal dicts are stored only once.
+        Dicts are read in a single pass, so they can be generated one at a time (see DefectsAnalysis.from_json()).
+
+        Parameters
+        ----------
+        dicts : (list or iterable)
+            Dict representations of SingleDefectData.
+            
+        Returns
+        -------
+        DefectEntrySet object
+        """
+        bulk_structures = []
+        structure_indexes = []
+        rows = []
+        for d in dicts:
+            for i,bulk_dict in enumerate(bulk_structures):
+                if bulk_dict == d['bulk_structure']:
+                    structure_indexes.append(i)
+                    break
+            else:
+                structure_indexes.append(len(bulk_structures))
+                bulk_structures.append(d['bulk_structure'])
+
+            rows.append({
+                'delta_atoms':{Element(e):d['delta_atoms'][e] for e in d['delta_atoms']},
+                'energy_diff':d['energy_diff'],
+                'corrections':d['corrections'] if d['corrections'] else {},
+                'charge':d['charge'],
+                'multiplicity':d['multiplicity'] if 'multiplicity' in d.keys() else 1, # adapt to import old dict
+                'name':d['name'],
+                'defect_site':d['defect_site'] if d['defect_site'] else None
+                })
+
+        return cls._from_rows(rows,bulk_structures,structure_indexes)
+
+
+    @classmethod
+    def _from_rows(cls,entries,bulk_structures,structure_indexes):
+        """
+        Build the arrays from rows (objects or dicts) with the attributes of SingleDefectData.
+        """
+        def _get(entry,key):
+            return entry[key] if isinstance(entry,dict) else getattr(entry,key)
+
+        elements, element_positions = [], {}
+        correction_types, correction_positions = [], {}
+        names, name_positions = [], {}
+        for entry in entries:
+            for el in _get(entry,'delta_atoms'):
+                if el not in element_positions:
+                    element_positions[el] = len(elements)
+                    elements.append(el)
+            for c in _get(entry,'corrections'):
+                if c not in correction_positions:
+                    correction_positions[c] = len(correction_types)
+                    correction_types.append(c)
+            if _get(entry,'name') not in name_positions:
+                name_positions[_get(entry,'name')] = len(names)
+                names.append(_get(entry,'name'))
+
+        nentries = len(structure_indexes)
+        delta_atoms = [[0]*len(elements) for i in range(nentries)]
+        delta_atoms_mask = np.zeros((nentries,len(elements)),dtype=bool)
+        corrections = np.zeros((nentries,len(correction_types)))
+        corrections_mask = np.zeros((nentries,len(correction_types)),dtype=bool)
+        for i,entry in enumerate(entries):
+            for el,n in _get(entry,'delta_atoms').items():
+                delta_atoms[i][element_positions[el]] = n
+                delta_atoms_mask[i,element_positions[el]] = True
+            for c,value in _get(entry,'corrections').items():
+                corrections[i,correction_positions[c]] = value
+                corrections_mask[i,correction_positions[c]] = True
+
+        return cls(
+            bulk_structures=bulk_structures,
+            structure_indexes=structure_indexes,
+            elements=elements,
+            delta_atoms=np.array(delta_atoms).reshape(nentries,len(elements)),
+            energy_diffs=[_get(entry,'energy_diff') for entry in entries],
+            correction_types=correction_types,
+            corrections=corrections,
+            charges=[_get(entry,'charge') for entry in entries],
+            multiplicities=np.array([_get(entry,'multiplicity') for entry in entries]),
+            names=names,
+            entry_names=[name_positions[_get(entry,'name')] for entry in entries],
+            defect_sites=[_get(entry,'defect_site') for entry in entries],
+            delta_atoms_mask=delta_atoms_mask,
+            corrections_mask=corrections_mask)
+
+
+    def get_columns(self):
+        """
+        Get the arrays and a json-serializable dictionary with the other data (elements, names, bulk 
+        structures and defect sites as dicts), used to store the set in binary format.
+        The set can be rebuilt with from_columns().
+
+        Returns
+        -------
+        arrays : (dict)
+            Dictionary with the NumPy arrays of the set.
+        metadata : (dict)
+            Json-serializable dictionary with the other data.
+        """
+        arrays = {
+            'structure_indexes':self._structure_indexes,
+            'delta_atoms':self._delta_atoms,
+            'delta_atoms_mask':self._delta_atoms_mask,
+            'energy_diffs':self._energy_diffs,
+            'corrections':self._corrections,
+            'corrections_mask':self._corrections_mask,
+            'charges':self._charges,
+            'multiplicities':self._multiplicities,
+            'entry_names':self._entry_names
+            }
+        metadata = {
+            'elements':[el.symbol for el in self._elements],
+            'correction_types':self._correction_types,
+            'names':self._names,
+            'bulk_structures':[s if isinstance(s,dict) else s.as_dict() for s in self._bulk_structures],
+            'defect_sites':[s.as_dict() if isinstance(s,PeriodicSite) else s for s in self._defect_sites]
+            }
+        return arrays, metadata
+
+
+    @classmethod
+    def from_columns(cls,arrays,metadata):
+        """
+        Build a DefectEntrySet from arrays and metadata generated with get_columns(). 
+        Arrays are used without copies (they can be memory-mapped), bulk structures
+        and defect sites are converted when accessed.
+        """
+        return cls(
+            bulk_structures=metadata['bulk_structures'],
+            structure_indexes=arrays['structure_indexes'],
+            elements=[Element(el) for el in metadata['elements']],
+            delta_atoms=arrays['delta_atoms'],
+            energy_diffs=arrays['energy_diffs'],
+            correction_types=metadata['correction_types'],
+            corrections=arrays['corrections'],
+            charges=arrays['charges'],
+            multiplicities=arrays['multiplicities'],
+            names=metadata['names'],
+            entry_names=arrays['entry_names'],
+            defect_sites=metadata['defect_sites'],
+            delta_atoms_mask=arrays['delta_atoms_mask'],
+            corrections_mask=arrays['corrections_mask'])
+
+
+    def select(self,indexes):
+        """
+        Get a new DefectEntrySet with a subset of the entries. Bulk structures are shared with
+        the original set.
+
+        Parameters
+        ----------
+        indexes : (ndarray)
+            Indexes or boolean mask of the entries to select.
+
+        Returns
+        -------
+        DefectEntrySet object
+        """
+        indexes = np.arange(len(self))[indexes]
+        # names that are not used anymore are removed, the order of the others is kept
+        used_names = np.unique(self._entry_names[indexes])
+        name_positions = np.zeros(len(self._names),dtype=int)
+        name_positions[used_names] = np.arange(len(used_names))
+
+        return DefectEntrySet(
+            bulk_structures=self._bulk_structures,
+            structure_indexes=self._structure_indexes[indexes],
+            elements=self._elements,
+            delta_atoms=self._delta_atoms[indexes],
+            energy_diffs=self._energy_diffs[indexes],
+            correction_types=self._correction_types,
+            corrections=self._corrections[indexes],
+            charges=self._charges[indexes],
+            multiplicities=self._multiplicities[indexes],
+            names=[self._names[i] for i in used_names],
+            entry_names=name_positions[self._entry_names[indexes]],
+            defect_sites=[self._defect_sites[i] for i in indexes],
+            delta_atoms_mask=self._delta_atoms_mask[indexes],
+            corrections_mask=self._corrections_mask[indexes])
+
+
+    def concatenate(self,entries):
+        """
+        Get a new DefectEntrySet with the entries of this set followed by new entries. Elements,
+        correction types and names of the new entries that are not present in the set are appended,
+        the order of the existing ones is kept. Bulk structures are shared with the original set.
+
+        Parameters
+        ----------
+        entries : (list or DefectEntrySet)
+            List of SingleDefectData objects or DefectEntrySet with the entries to add.
+
+        Returns
+        -------
+        DefectEntrySet object
+        """
+        other = entries if isinstance(entries,DefectEntrySet) else DefectEntrySet.from_entries(entries)
+        
+        def _merge(labels,new_labels):
+            # merged list of labels and position of the new labels in the merged list
+            labels = list(labels)
+            positions = []
+            for label in new_labels:
+                if label not in labels:
+                    labels.append(label)
+                positions.append(labels.index(label))
+            return labels, np.array(positions,dtype=int)
+        
+        def _stack(matrix,new_matrix,ncolumns,new_positions):
+            # matrices with columns of the old and new labels stacked on the merged columns
+            stacked = np.zeros((len(matrix) + len(new_matrix),ncolumns),dtype=matrix.dtype)
+            stacked[:len(matrix),:matrix.shape[1]] = matrix
+            stacked[len(matrix):,new_positions] = new_matrix
+            return stacked
+        
+        # bulk structures that are the same object are stored only once
+        bulk_structures = list(self._bulk_structures)
+        structure_positions = []
+        for structure in other._bulk_structures:
+            for i,s in enumerate(bulk_structures):
+                if s is structure:
+                    structure_positions.append(i)
+                    break
+            else:
+                structure_positions.append(len(bulk_structures))
+                bulk_structures.append(structure)
+        
+        elements, element_positions = _merge(self._elements,other._elements)
+        correction_types, correction_positions = _merge(self._correction_types,other._correction_types)
+        names, name_positions = _merge(self._names,other._names)
+        
+        return DefectEntrySet(
+            bulk_structures=bulk_structures,
+            structure_indexes=np.concatenate([self._structure_indexes,np.array(structure_positions,dtype=int)[other._structure_indexes]]),
+            elements=elements,
+            delta_atoms=_stack(self._delta_atoms,other._delta_atoms,len(elements),element_positions),
+            energy_diffs=np.concatenate([self._energy_diffs,other._energy_diffs]),
+            correction_types=correction_types,
+            corrections=_stack(self._corrections,other._corrections,len(correction_types),correction_positions),
+            charges=np.concatenate([self._charges,other._charges]),
+            multiplicities=np.concatenate([self._multiplicities,other._multiplicities]),
+            names=names,
+            entry_names=np.concatenate([self._entry_names,name_positions[other._entry_names]]),
+            defect_sites=self._defect_sites + other._defect_sites,
+            delta_atoms_mask=_stack(self._delta_atoms_mask,other._delta_atoms_mask,len(elements),element_positions),
+            corrections_mask=_stack(self._corrections_mask,other._corrections_mask,len(correction_types),correction_positions))
+
+
+    def to_entries(self):
+        """
+        Get a list of SingleDefectData objects with the data of the entries.
+        """
+        return [SingleDefectData(row.bulk_structure,row.delta_atoms,row.energy_diff,row.corrections,row.charge,
+                                 row.multiplicity,row.name,row.defect_site) for row in self]
+
+
+
+class DefectEntryRow:
+    """
+    Lightweight view of one entry of a DefectEntrySet with the same interface of SingleDefectData.
+    Dicts of delta_atoms and corrections are built from the arrays of the set when requested.
+    """
+    __slots__ = ('_entry_set','_index')
+
+    def __init__(self,entry_set,index):
+        self._entry_set = entry_set
+        self._index = index
+
+    def __repr__(self):
+        return f'DefectEntryRow {self._index}: {self.name}, charge {self.charge}'
+
+    @property
+    def bulk_structure(self):
+        return self._entry_set.get_bulk_structure(self._entry_set.structure_indexes[self._index])
+
+    @property
+    def delta_atoms(self):
+        s, i = self._entry_set, self._index
+        return {el:n for el,n,present in zip(s.elements,s.delta_atoms[i].tolist(),s.delta_atoms_mask[i]) if present}
+
+    @property
+    def energy_diff(self):
+        return self._entry_set.energy_diffs[self._index].item()
+
+    @property
+    def corrections(self):
+        s, i = self._entry_set, self._index
+        return {c:value for c,value,present in zip(s.correction_types,s.corrections[i].tolist(),s.corrections_mask[i]) if present}
+
+    @property
+    def charge(self):
+        charge = self._entry_set.charges[self._index].item()
+        return int(charge) if charge.is_integer() else charge
+
+    @property
+    def multiplicity(self):
+        return self._entry_set.multiplicities[self._index].item()
+
+    @property
+    def name(self):
+        return self._entry_set.names[self._entry_set.entry_names[self._index]]
+
+    @property
+    def defect_site(self):
+        return self._entry_set.get_defect_site(self._index)
+
+    def as_dict(self):
+        """
+        Returns:
+            Json-serializable dict representation, same as SingleDefectData.as_dict()
+        """
+        d = SingleDefectData.as_dict(self)
+        d['@module'] = SingleDefectData.__module__
+        d['@class'] = SingleDefectData.__name__
+        return d
+
+    formation_energy = SingleDefectData.formation_energy
+    defect_concentration = SingleDefectData.defect_concentration
+
+
+
 class DefectsAnalysis:
     """ 
     Class to compute defect properties starting from single calculations of defects
     Args:
-        defect_entries ([SingleDefectData]): A list of SingleDefectData objects
+        defect_entries ([SingleDefectData] or DefectEntrySet): A list of SingleDefectData objects or
+            a DefectEntrySet (more compact for large number of entries)
         vbm (float): Valence Band energy to use for all defect entries.
             NOTE if using band shifting-type correction then this VBM
             should still be that of the GGA calculation
@@ -176,43 +735,660 @@ class DefectsAnalysis:
             NOTE if using band shifting-type correction then this gap
             should still be that of the Hybrid calculation you are shifting to.       
     """    
+    # max number of sets of chemical potentials stored in the caches of formation energies and lower envelopes
+    intercepts_cache_size = 128
+    
     def __init__(self, defect_entries, vbm, band_gap):
+        self._intercepts_cache = OrderedDict()
+        self._envelopes_cache = OrderedDict()
+        self._band_arrays_cache = None
         self.defect_entries = defect_entries
         self.vbm = vbm
         self.band_gap = band_gap
         
 
-    def as_dict(self):
+    @property
+    def defect_entries(self):
+        return self._defect_entries
+    
+    @defect_entries.setter
+    def defect_entries(self, defect_entries):
+        # packed arrays and indexes are rebuilt lazily from the new list of entries
+        self._defect_entries = defect_entries
+        self._packed_entries = None
+        self._intercepts_cache.clear()
+        self._envelopes_cache.clear()
+
+    @property
+    def vbm(self):
+        return self._vbm
+    
+    @vbm.setter
+    def vbm(self, vbm):
+        self._vbm = vbm
+        self._intercepts_cache.clear()
+        self._envelopes_cache.clear()
+
+    @property
+    def band_gap(self):
+        return self._band_gap
+    
+    @band_gap.setter
+    def band_gap(self, band_gap):
+        self._band_gap = band_gap
+        self._intercepts_cache.clear()
+        self._band_arrays_cache = None
+
+
+    def as_dict(self):
+        """
+        Returns:
+            Json-serializable dict representation of DefectsAnalysis
+        """
+        d = {
+        "@module": self.__class__.__module__,
+        "@class": self.__class__.__name__,
+        "defect_entries": [entry.as_dict() for entry in self.defect_entries],
+        "vbm":self.vbm,
+        "band_gap":self.band_gap
+            }
+        return d
+
+
+    @classmethod
+    def from_dict(cls,d,entry_set=False):
+        """
+        Reconstitute a DefectsAnalysis object from a dict representation created using
+        as_dict().
+
+        Args:
+            d (dict): dict representation of DefectsAnalysis.
+            entry_set (bool): Store the entries in a DefectEntrySet, bulk structures are deserialized
+                only once. Default is False (list of SingleDefectData).
+
+        Returns:
+            DefectsAnalysis object
+        """
+        if entry_set:
+            defect_entries = DefectEntrySet.from_dicts(d['defect_entries'])
+        else:
+            defect_entries = [SingleDefectData.from_dict(entry_dict) for entry_dict in d['defect_entries']]        
+        vbm = d['vbm']
+        band_gap = d['band_gap']
+        return cls(defect_entries,vbm,band_gap)
+
+
+    @classmethod
+    def from_npz(cls,path,mmap=True):
+        """
+        Build DefectsAnalysis object from a binary .npz file generated with to_npz().
+        Entries are stored in a DefectEntrySet, bulk structures and defect sites are converted 
+        to pymatgen objects when accessed for the first time.
+
+        Parameters
+        ----------
+        path : (str)
+            Path to the .npz file.
+        mmap : (bool), optional
+            Memory-map the arrays of the entries instead of reading them. The default is True.
+
+        Returns
+        -------
+        DefectsAnalysis object.
+        """
+        arrays, metadata = load_npz(path,mmap=mmap)
+        defect_entries = DefectEntrySet.from_columns(arrays,metadata)
+        return cls(defect_entries,metadata['vbm'],metadata['band_gap'])
+
+
+    @classmethod
+    def from_json(cls,path_or_string,lazy=False,chunk_size=2**20):
+        """
+        Build DefectsAnalysis object from json file or string.
+
+        Parameters
+        ----------
+        path_or_string : (str)
+            If an existing path to a file is given the object is constructed reading the json file.
+            Otherwise it will be read as a string.
+        lazy : (bool), optional
+            Read the json in chunks and store the entries in a DefectEntrySet. Only the numeric
+            fields needed for thermodynamics are parsed, bulk structures and defect sites are converted 
+            to pymatgen objects when accessed for the first time. Memory usage is bounded by the size
+            of the single entries and of the different bulk structures. The default is False.
+        chunk_size : (int), optional
+            Number of characters read at a time if lazy is True. The default is 2**20.
+
+        Returns
+        -------
+        DefectsAnalysis object.
+        """
+        if op.isfile(path_or_string):
+            file = open(path_or_string)
+        else:
+            file = io.StringIO(path_or_string)
+        
+        with file:
+            if not lazy:
+                return cls.from_dict(json.load(file))
+            
+            d = {}
+            def _get_entry_dicts():
+                for key,value in iter_json_object(file,stream_keys=['defect_entries'],chunk_size=chunk_size):
+                    if key == 'defect_entries':
+                        yield value
+                    else:
+                        d[key] = value
+                        
+            defect_entries = DefectEntrySet.from_dicts(_get_entry_dicts())
+        
+        return cls(defect_entries,d['vbm'],d['band_gap'])
+    
+    
+    def to_npz(self,path):
+        """
+        Save DefectsAnalysis object in a binary .npz file. Numeric data of the entries are stored 
+        as arrays (memory-mappable with from_npz()), bulk structures are stored once. The conversion
+        to the json format (as_dict()) is lossless.
+
+        Parameters
+        ----------
+        path : (str)
+            Path to the destination file.
+        """
+        entries = self.defect_entries
+        if not isinstance(entries,DefectEntrySet):
+            entries = DefectEntrySet.from_entries(entries)
+        arrays, metadata = entries.get_columns()
+        metadata.update({
+            "@module": self.__class__.__module__,
+            "@class": self.__class__.__name__,
+            "vbm":self.vbm,
+            "band_gap":self.band_gap
+            })
+        save_npz(path,arrays,metadata)
+        return
+    
+    
+    def _get_packed_entries(self):
+        """
+        Build the NumPy arrays and the indexes describing the defect entries. They are computed only once
+        and rebuilt when a new list of defect entries is assigned or when entries are added or removed 
+        from the list in place (add_entries() and remove_entries() update them incrementally instead). 
+        If the entries are stored in a DefectEntrySet its arrays are used without copies.
+
+        Returns
+        -------
+        packed : (dict)
+            Dictionary with the following keys:
+                - "charges" : array with the charge of every entry
+                - "energies" : array with energy_diff plus the sum of the corrections of every entry
+                - "delta_atoms" : matrix (entries x elements) with the delta_atoms of every entry
+                - "delta_atoms_mask" : boolean matrix with the elements present in the delta_atoms of every entry
+                - "site_densities" : array with the density of defect sites (multiplicity * 1e24 / volume) in cm^-3
+                - "elements" : list of Element objects labelling the columns of "delta_atoms"
+                - "names" : list with the different names of the defect entries
+                - "entry_names" : array with the index in "names" of the name of every entry
+                - "name_indexes" : list of arrays with the indexes of the entries of every name
+                - "name_positions" : dict with names as keys and their index in "names" as values
+                - "charge_indexes" : dict with charges as keys and arrays with the indexes of the entries as values
+                - "element_indexes" : dict with Element objects as keys and arrays with the indexes of the 
+                                      entries with that element in delta_atoms as values
+                - "number_elements" : array with the number of elements in the delta_atoms of every entry
+                - "constituents" : dict with names as keys and lists of tuples (name of single defect,number)
+                                   as values, with the single defects of which every defect is made.
+                                   The name is None if the single defect is not found.
+                - "entries" : DefectEntrySet or copy of the list of entries used to build the arrays
+        """
+        entries = self._defect_entries
+        if isinstance(entries,DefectEntrySet):
+            # entry sets are immutable, arrays are used directly without copies
+            is_outdated = self._packed_entries is None or self._packed_entries['entries'] is not entries
+        else:
+            # the list of entries can be modified in place, comparison is done by identity of the entries
+            is_outdated = self._packed_entries is None or self._packed_entries['entries'] != entries
+            
+        if is_outdated:
+            arrays = self._get_entries_arrays(entries)
+            entry_names, charges, elements_mask = arrays['entry_names'], arrays['charges'], arrays['delta_atoms_mask']
+            name_indexes = [np.flatnonzero(entry_names == i) for i in range(len(arrays['names']))]
+            charge_indexes = {q:np.flatnonzero(charges == q) for q in np.unique(charges)}
+            element_indexes = {el:np.flatnonzero(elements_mask[:,i]) for i,el in enumerate(arrays['elements'])}
+            
+            self._intercepts_cache.clear()
+            self._envelopes_cache.clear()
+            self._set_packed_entries(entries,arrays,name_indexes,charge_indexes,element_indexes)
+        
+        return self._packed_entries
+
+
+    def _get_constituents(self, packed, names):
+        """
+        Single defects of which every defect in names is made: single defects (only 1 element in delta_atoms) 
+        with the same sign of delta_atoms (vacancy or interstitial) for every element of the first entry of the name.
+        Returns a dict with names as keys and lists of tuples (name of single defect or None,number) as values.
+        """
+        delta_atoms, elements_mask = packed['delta_atoms'], packed['delta_atoms_mask']
+        constituents = {}
+        for name in names:
+            i = packed['name_indexes'][packed['name_positions'][name]][0]
+            constituents[name] = []
+            for j in np.flatnonzero(elements_mask[i]):
+                candidates = packed['element_indexes'][packed['elements'][j]]
+                is_single = packed['number_elements'][candidates] == 1
+                same_sign = np.sign(delta_atoms[candidates,j]) == np.sign(delta_atoms[i,j])
+                candidates = candidates[is_single & same_sign]
+                single = packed['names'][packed['entry_names'][candidates[-1]]] if len(candidates) > 0 else None
+                constituents[name].append((single,abs(delta_atoms[i,j])))
+        
+        return constituents
+
+
+    @staticmethod
+    def _get_entries_arrays(entries, elements=[], names=[]):
+        """
+        Arrays with the data of the entries needed by _get_packed_entries(). For a DefectEntrySet the arrays 
+        of the set are used. For a list of entries the columns of delta_atoms start with the given elements 
+        and the names start with the given names, new elements and names are appended in order of appearance.
+        """
+        if isinstance(entries,DefectEntrySet):
+            return {
+                'charges':entries.charges,
+                'energies':entries.energies,
+                'site_densities':entries.site_densities,
+                'delta_atoms':entries.delta_atoms,
+                'delta_atoms_mask':entries.delta_atoms_mask,
+                'elements':entries.elements,
+                'names':entries.names,
+                'entry_names':entries.entry_names
+                }
+        
+        name_positions = {name:i for i,name in enumerate(names)}
+        element_positions = {el:i for i,el in enumerate(elements)}
+        for entry in entries:
+            if entry.name not in name_positions:
+                name_positions[entry.name] = len(name_positions)
+            for el in entry.delta_atoms:
+                if el not in element_positions:
+                    element_positions[el] = len(element_positions)
+        
+        delta_atoms = np.zeros((len(entries),len(element_positions)))
+        elements_mask = np.zeros((len(entries),len(element_positions)),dtype=bool)
+        for i,entry in enumerate(entries):
+            for el,n in entry.delta_atoms.items():
+                delta_atoms[i,element_positions[el]] = n
+                elements_mask[i,element_positions[el]] = True
+                
+        return {
+            'charges':np.array([entry.charge for entry in entries],dtype=float),
+            'energies':np.array([entry.energy_diff + sum(entry.corrections.values()) for entry in entries],dtype=float),
+            'site_densities':np.array([entry.multiplicity * 1e24 / entry.bulk_structure.volume for entry in entries],dtype=float),
+            'delta_atoms':delta_atoms,
+            'delta_atoms_mask':elements_mask,
+            'elements':list(element_positions),
+            'names':list(name_positions),
+            'entry_names':np.array([name_positions[entry.name] for entry in entries],dtype=int)
+            }
+
+
+    def _get_entry_indexes(self, entries):
+        """
+        Indexes in defect_entries of a list of entries (entry objects or integer indexes).
+        """
+        defect_entries = self._defect_entries
+        positions = None
+        indexes = []
+        for entry in entries:
+            if isinstance(entry,(int,np.integer)):
+                indexes.append(int(entry))
+            elif isinstance(entry,DefectEntryRow) and entry._entry_set is defect_entries:
+                indexes.append(entry._index)
+            else:
+                if positions is None:
+                    positions = {id(e):i for i,e in enumerate(defect_entries)}
+                if id(entry) not in positions:
+                    raise ValueError(f'Entry {entry} is not in defect entries')
+                indexes.append(positions[id(entry)])
+        
+        return np.array(indexes,dtype=int)
+
+
+    def _get_non_eq_groups(self, frozen_defect_concentrations, external_defects=[]):
+        """
+        Sort the contributions to the defect charge in non-equilibrium conditions in the groups
+        D1 (frozen), D2 (normal) and D3 (external), see non_equilibrium_fermi_level().
+        Frozen species not present in the defect entries are skipped with a warning.
+
+        Parameters
+        ----------
+        frozen_defect_concentrations : (list or ndarray)
+            List of defect concentrations, most likely generated with defect_concentrations(), or
+            array of concentrations aligned with defect_entries (see defect_concentrations_array()).
+        external_defects : (list)
+            List of external defect concentrations (not present in defect entries).
+
+        Returns
+        -------
+        frozen_totals : (ndarray)
+            Total concentration of every defect name (same order as packed names), 0 if the 
+            specie is not frozen (group D2).
+        external_charges : (tuple)
+            Absolute values of positive and negative charge concentrations of external defects (group D3).
+        """
+        packed = self._get_packed_entries()
+        name_positions = packed['name_positions']
+        if isinstance(frozen_defect_concentrations,np.ndarray):
+            frozen_totals = np.bincount(packed['entry_names'],weights=frozen_defect_concentrations,minlength=len(name_positions))
+            frozen_defect_concentrations = []
+        else:
+            frozen_totals = np.zeros(len(name_positions))
+        for d in frozen_defect_concentrations:
+            name = d['name']
+            if name in name_positions:           
+                frozen_totals[name_positions[name]] += d['conc']
+            else:
+                print(f'Warning: Frozen defect named "{name}" is not in the list of computed defects and will not contribute to the calculation')
+        
+        q_positive, q_negative = 0, 0
+        for d_ext in external_defects:
+            if d_ext['charge'] > 0:
+                q_positive += d_ext['charge']*d_ext['conc']
+            elif d_ext['charge'] < 0:
+                q_negative += -1*d_ext['charge']*d_ext['conc']
+        
+        return frozen_totals, (q_positive,q_negative)
+    
+    
+    def _set_packed_entries(self, entries, arrays, name_indexes, charge_indexes, element_indexes, 
+                            updated_names=None, previous=None):
+        """
+        Store the packed arrays and indexes of the entries (see _get_packed_entries()). Constituents are
+        computed only for the names in updated_names and copied from the previous packed entries for the 
+        other names. The default is None (all names are computed).
+        """
+        names = list(arrays['names'])
+        packed = {
+            'charges':arrays['charges'],
+            'energies':arrays['energies'],
+            'delta_atoms':arrays['delta_atoms'],
+            'delta_atoms_mask':arrays['delta_atoms_mask'],
+            'site_densities':arrays['site_densities'],
+            'elements':list(arrays['elements']),
+            'names':names,
+            'entry_names':arrays['entry_names'],
+            'name_indexes':name_indexes,
+            'name_positions':{name:i for i,name in enumerate(names)},
+            'charge_indexes':charge_indexes,
+            'element_indexes':element_indexes,
+            'number_elements':arrays['delta_atoms_mask'].sum(axis=1),
+            'entries':entries if isinstance(entries,DefectEntrySet) else list(entries)
+            }
+        if updated_names is None:
+            packed['constituents'] = self._get_constituents(packed,names)
+        else:
+            constituents = self._get_constituents(packed,[name for name in names if name in updated_names])
+            packed['constituents'] = {name:constituents[name] if name in constituents else previous['constituents'][name] 
+                                      for name in names}
+        
+        self._packed_entries = packed
+        return
+    
+
+    def _get_stable_indexes(self,formation_energies):
+        """
+        Find the entries with the lowest formation energy for every defect name.
+
+        Parameters
+        ----------
+        formation_energies : (ndarray)
+            Array of formation energies with the entries on the last axis, 
+            most likely generated with formation_energies_array().
+
+        Returns
+        -------
+        stable_indexes : (ndarray)
+            Array with the same leading dimensions of formation_energies and the defect names on the 
+            last axis. Values are the indexes of the most stable entry for every name. 
+            In case of equal energies the first entry is taken.
         """
-        Returns:
-            Json-serializable dict representation of DefectsAnalysis
+        name_indexes = self._get_packed_entries()['name_indexes']
+        stable_indexes = np.zeros(formation_energies.shape[:-1] + (len(name_indexes),),dtype=int)
+        for i,indexes in enumerate(name_indexes):
+            stable_indexes[...,i] = indexes[np.argmin(formation_energies[...,indexes],axis=-1)]
+        
+        return stable_indexes
+    
+    
+    def _get_band_arrays(self, bulk_dos):
         """
-        d = {
-        "@module": self.__class__.__module__,
-        "@class": self.__class__.__name__,
-        "defect_entries": [entry.as_dict() for entry in self.defect_entries],
-        "vbm":self.vbm,
-        "band_gap":self.band_gap
+        Arrays of the band states of the bulk DOS used to compute the carrier concentrations 
+        (see neutrality.get_band_arrays()). The arrays are stored for the last bulk DOS used, and 
+        recomputed if the bulk DOS or the band gap change. The FermiDosCarriersInfo object is taken
+        from the process-wide cache (see pmg_dos.get_fermi_dos()), shared with other DefectsAnalysis objects.
+        """
+        if self._band_arrays_cache is None or self._band_arrays_cache[0] is not bulk_dos:
+            fdos = get_fermi_dos(bulk_dos, bandgap=self.band_gap)
+            self._band_arrays_cache = (bulk_dos,get_band_arrays(fdos))
+        return self._band_arrays_cache[1]
+    
+    
+    def _get_concentrations_dicts(self, concentrations, indexes=None):
+        """
+        List of dictionaries {"conc","name","charge"} from the array of concentrations of the entries, 
+        for the compatibility with the API based on dictionaries. Only the entries in indexes are included 
+        if provided. Charges are given as int if they are integers.
+        """
+        packed = self._get_packed_entries()
+        indexes = range(len(concentrations)) if indexes is None else indexes
+        names, entry_names = packed['names'], packed['entry_names'].tolist()
+        charges = [int(q) if q.is_integer() else q for q in packed['charges'].tolist()]
+        return [{'conc':concentrations[i],'name':names[entry_names[i]],'charge':charges[i]} for i in indexes]
+        
+        
+    def _get_grid_dict(self,temperatures,chempots,fermi_levels,carriers,concentrations,iterations):
+        """
+        Organize the results of the charge neutrality for a grid of temperatures (N) and 
+        chemical potentials (M) in a dictionary of arrays. Conditions are flattened as (N,M).
+        See solve_grid() for the description of the dictionary.
+        """
+        packed = self._get_packed_entries()
+        ntemp, nchem = len(temperatures), len(chempots)
+        concentrations_total = np.stack([concentrations[:,indexes].sum(axis=-1) for indexes in packed['name_indexes']],axis=-1)
+        grid = {
+            'temperatures':temperatures,
+            'chemical_potentials':chempots,
+            'elements':list(packed['elements']),
+            'fermi_levels':fermi_levels.reshape(ntemp,nchem),
+            'holes':carriers[:,0].reshape(ntemp,nchem),
+            'electrons':carriers[:,1].reshape(ntemp,nchem),
+            'defect_concentrations':concentrations.reshape(ntemp,nchem,-1),
+            'defect_concentrations_total':concentrations_total.reshape(ntemp,nchem,-1),
+            'names':[packed['names'][i] for i in packed['entry_names']],
+            'charges':packed['charges'],
+            'defect_names':list(packed['names']),
+            'iterations':iterations.reshape(ntemp,nchem)
             }
-        return d
+        
+        return grid
+    
+    
+    def _get_intercepts(self,chempots):
+        """
+        Formation energies of all defect entries at Fermi level = 0 (vbm) for an array of chemical potentials.
+        Results for single sets of chemical potentials are stored in a LRU cache keyed on the values of
+        the chemical potentials, which is cleared when entries, vbm or band gap change.
+        """
+        packed = self._get_packed_entries()
+        if chempots.ndim != 1:
+            return packed['energies'] + packed['charges']*self.vbm - np.dot(chempots,packed['delta_atoms'].T)
+        
+        key = tuple(chempots.tolist())
+        if key in self._intercepts_cache:
+            self._intercepts_cache.move_to_end(key)
+        else:
+            intercepts = packed['energies'] + packed['charges']*self.vbm - np.dot(chempots,packed['delta_atoms'].T)
+            intercepts.flags.writeable = False
+            self._intercepts_cache[key] = intercepts
+            if len(self._intercepts_cache) > self.intercepts_cache_size:
+                self._intercepts_cache.popitem(last=False)
+        
+        return self._intercepts_cache[key]
+    
+    
+    def _get_lower_envelopes(self,chemical_potentials):
+        """
+        Compute the lower envelope of the formation energy lines for every defect name. Envelopes are
+        stored in a LRU cache keyed on the values of the chemical potentials, every name is computed 
+        only once and recomputed only when its entries change (see add_entries() and remove_entries()).
 
+        Parameters
+        ----------
+        chemical_potentials : (dict)
+            Dictionary of chemical potentials ({Element:chempot}). If None chemical potentials are not included.
 
-    @classmethod
-    def from_dict(cls,d):
+        Returns
+        -------
+        envelopes : (dict)
+            Dictionary with defect names as keys and tuples (indexes,transitions) as values.
+            indexes is the array of the indexes of the stable entries from low to high Fermi level, 
+            transitions is the array of the Fermi levels at which the stable entry changes 
+            (len(transitions) = len(indexes) - 1). See get_lower_envelope().
         """
-        Reconstitute a DefectsAnalysis object from a dict representation created using
-        as_dict().
+        packed = self._get_packed_entries()
+        chempots = self.get_chempots_array(chemical_potentials)
+        key = tuple(chempots.tolist())
+        if key in self._envelopes_cache:
+            self._envelopes_cache.move_to_end(key)
+        else:
+            self._envelopes_cache[key] = {}
+            if len(self._envelopes_cache) > self.intercepts_cache_size:
+                self._envelopes_cache.popitem(last=False)
+        envelopes = self._envelopes_cache[key]
+        
+        missing = [i for i,name in enumerate(packed['names']) if name not in envelopes]
+        if missing:
+            intercepts = self.formation_energies_array(chempots,fermi_levels=0)
+            for i in missing:
+                indexes = packed['name_indexes'][i]
+                stable, transitions = get_lower_envelope(packed['charges'][indexes],intercepts[indexes])
+                envelopes[packed['names'][i]] = (indexes[stable],transitions)
+        
+        return {name:envelopes[name] for name in packed['names']}
+    
+    
+    def add_entries(self, entries):
+        """
+        Add defect entries. Packed arrays and indexes of the entries are updated incrementally and 
+        the cached formation energies are extended with the new entries. Only the lower envelopes and 
+        the single defects (constituents) of the defect names that are affected by the new entries are 
+        recomputed. New names and elements are appended to names() and elements().
 
-        Args:
-            d (dict): dict representation of DefectsAnalysis.
+        Parameters
+        ----------
+        entries : (list or DefectEntrySet)
+            List of SingleDefectData objects or DefectEntrySet with the new entries.
+        """
+        packed = self._get_packed_entries()
+        nold = len(packed['charges'])
+        if isinstance(self._defect_entries,DefectEntrySet):
+            defect_entries = self._defect_entries.concatenate(entries)
+            arrays = self._get_entries_arrays(defect_entries)
+        else:
+            # a DefectEntrySet is added as rows, such that names and elements are mapped on the existing ones
+            entries = list(entries)
+            defect_entries = list(self._defect_entries) + entries
+            arrays = self._get_entries_arrays(entries,packed['elements'],packed['names'])
+            # columns of new elements are added to the old entries
+            for key in ('delta_atoms','delta_atoms_mask'):
+                old = np.zeros((nold,len(arrays['elements'])),dtype=arrays[key].dtype)
+                old[:,:len(packed['elements'])] = packed[key]
+                arrays[key] = np.concatenate([old,arrays[key]])
+            for key in ('charges','energies','site_densities','entry_names'):
+                arrays[key] = np.concatenate([packed[key],arrays[key]])
+        
+        new_indexes = np.arange(nold,len(arrays['charges']))
+        new_entry_names = arrays['entry_names'][nold:]
+        new_charges = arrays['charges'][nold:]
+        new_mask = arrays['delta_atoms_mask'][nold:]
+        
+        name_indexes = list(packed['name_indexes']) + [np.zeros(0,dtype=int)]*(len(arrays['names']) - len(packed['names']))
+        for i in np.unique(new_entry_names):
+            name_indexes[i] = np.concatenate([name_indexes[i],new_indexes[new_entry_names == i]])
+        charge_indexes = dict(packed['charge_indexes'])
+        for q in np.unique(new_charges):
+            charge_indexes[q] = np.concatenate([charge_indexes.get(q,np.zeros(0,dtype=int)),new_indexes[new_charges == q]])
+        element_indexes = dict(packed['element_indexes'])
+        for j,el in enumerate(arrays['elements']):
+            element_indexes[el] = np.concatenate([element_indexes.get(el,np.zeros(0,dtype=int)),new_indexes[new_mask[:,j]]])
+        
+        # names of the new entries and complexes containing elements of new single defects
+        new_names = {arrays['names'][i] for i in np.unique(new_entry_names)}
+        updated_names = set(new_names)
+        new_singles = new_mask[new_mask.sum(axis=1) == 1].any(axis=0)
+        for name,indexes in zip(arrays['names'],name_indexes):
+            if np.any(arrays['delta_atoms_mask'][indexes[0]] & new_singles):
+                updated_names.add(name)
+        
+        self._defect_entries = defect_entries
+        self._set_packed_entries(defect_entries,arrays,name_indexes,charge_indexes,element_indexes,updated_names,packed)
+        
+        if len(arrays['elements']) != len(packed['elements']):
+            # cache keys depend on the number of elements
+            self._intercepts_cache.clear()
+            self._envelopes_cache.clear()
+        else:
+            new_energies = arrays['energies'][nold:]
+            new_delta_atoms = arrays['delta_atoms'][nold:]
+            for key,intercepts in self._intercepts_cache.items():
+                new_intercepts = new_energies + new_charges*self.vbm - np.dot(new_delta_atoms,key)
+                intercepts = np.concatenate([intercepts,new_intercepts])
+                intercepts.flags.writeable = False
+                self._intercepts_cache[key] = intercepts
+            for envelopes in self._envelopes_cache.values():
+                for name in new_names:
+                    envelopes.pop(name,None)
+        return
 
-        Returns:
-            DefectsAnalysis object
+
+    def binding_energies(self,fermi_levels,names=None):
         """
-        defect_entries = [SingleDefectData.from_dict(entry_dict) for entry_dict in d['defect_entries']]        
-        vbm = d['vbm']
-        band_gap = d['band_gap']
-        return cls(defect_entries,vbm,band_gap)
+        Compute the binding energies of defect complexes for an array of Fermi levels. The binding energy is the 
+        formation energy of the complex minus the formation energies of the single defects of which it is made,
+        all in their stable charge states. The single defects of every complex are found from delta_atoms.
+
+        Parameters
+        ----------
+        fermi_levels : (float or array)
+            Fermi levels relative to the vbm.
+        names : (list), optional
+            Names of the defect complexes. The default is None (all names with more than one element in delta_atoms).
+
+        Returns
+        -------
+        binding_energies : (ndarray)
+            Array (names x Fermi levels) with the binding energies.
+        """
+        packed = self._get_packed_entries()
+        if names is None:
+            names = [name for name,indexes in zip(packed['names'],packed['name_indexes']) 
+                     if packed['number_elements'][indexes[0]] > 1]
+        fermi_levels = np.atleast_1d(np.asarray(fermi_levels,dtype=float))
+        
+        # binding energies are linear combinations of the stable formation energies of all names
+        weights = np.zeros((len(names),len(packed['names'])))
+        for i,name in enumerate(names):
+            weights[i,packed['name_positions'][name]] += 1
+            for single,n in packed['constituents'][name]:
+                if single is None:
+                    raise ValueError(f'Single defects of which "{name}" is made are not present in defect entries')
+                weights[i,packed['name_positions'][single]] -= n
+        
+        # stable formation energies from the lower envelopes, exact at every Fermi level
+        envelopes = self.formation_energy_envelopes(None,energy_range=(fermi_levels.min(),fermi_levels.max()))
+        stable_energies = np.array([np.interp(fermi_levels,envelopes[name]['vertices'][:,0],envelopes[name]['vertices'][:,1])
+                                    for name in packed['names']]).reshape(len(packed['names']),len(fermi_levels))
+        
+        return np.dot(weights,stable_energies)
     
     
     def binding_energy(self,name,fermi_level=0):
@@ -223,35 +1399,7 @@ class DefectsAnalysis:
         Returns:
             binding_energy (float)
         """
-        # finding entry associated to 'name'        
-        for entry in self.defect_entries:
-            if entry.name == name:
-                defect_complex = entry
-                break
-        
-        # finding names and elements of single defects of which the complex is made
-        single_defects = {}
-        for el in entry.delta_atoms:
-            # sign of delta atoms - if > 0 interstitial, if < 0 vacancy
-            sign_el = 1 if entry.delta_atoms[el]>0 else -1 if entry.delta_atoms[el]<0 else 0
-            for d in self.defect_entries:
-                # has to be a single defect - delta_atoms needs to have only 1 key
-                if el in d.delta_atoms and len(d.delta_atoms.keys()) == 1:
-                    # sign in delta atoms of single defect has to be the same (Vacancy or interstitial)
-                    sign_el_single = 1 if d.delta_atoms[el]>0 else -1 if d.delta_atoms[el]<0 else 0 
-                    if sign_el == sign_el_single:
-                        # add name to dict of single defects to consider for binding energy
-                        single_defects[el] = d.name
-        
-        # getting stable charge states at desired fermi level                    
-        stable_charges = self.stable_charges(None,fermi_level=fermi_level)
-        # energy of defect complex
-        binding_energy = stable_charges[name][1]
-        # subtracting sum of energies of single defects
-        binding_energy += -1 * sum([abs(defect_complex.delta_atoms[el]) * stable_charges[single_defects[el]][1]
-                                    for el in defect_complex.delta_atoms])
-    
-        return binding_energy
+        return self.binding_energies(fermi_level,names=[name])[0,0]
 
 
     def carrier_concentrations_intrinsic(self,bulk_dos,temperature=300,fermi_level=0.):
@@ -260,19 +1408,29 @@ class DefectsAnalysis:
         given a fixed Fermi level
         Args:
             bulk_dos: bulk system dos (pymatgen Dos object)
-            temperature: Temperature to equilibrate fermi energies for
-            fermi_level: (float) is fermi level relative to valence band maximum
+            temperature: (float or array) Temperature to equilibrate fermi energies for
+            fermi_level: (float or array) is fermi level relative to valence band maximum
                 Default efermi = 0 = VBM energy         
+            Arrays of temperatures and Fermi levels are broadcasted against each other.
         Returns:
-            h,n in absolute values
+            h,n in absolute values (float or arrays with the broadcasted shape)
         """
-        
-        fdos = FermiDosCarriersInfo(bulk_dos, bandgap=self.band_gap)
-        _,fdos_vbm = fdos.get_cbm_vbm()    
-        
-        h, n = fdos.get_doping(fermi_level=fermi_level + fdos_vbm, temperature=temperature,carriers_values=True)
-        
-        return abs(h) , abs(n)
+        band_arrays = self._get_band_arrays(bulk_dos)
+        fermi_levels, temperatures = np.broadcast_arrays(np.asarray(fermi_level,dtype=float),
+                                                         np.asarray(temperature,dtype=float))
+        carriers = np.zeros((fermi_levels.size,2))
+        # conditions x band states matrices are built in chunks to limit memory usage
+        chunk_size = 1000
+        for start in range(0,fermi_levels.size,chunk_size):
+            stop = start + chunk_size
+            carriers[start:stop] = get_carriers_charge_array(band_arrays,fermi_levels.ravel()[start:stop],
+                                                             temperatures.ravel()[start:stop])[0]
+        h = carriers[:,0].reshape(fermi_levels.shape)
+        n = carriers[:,1].reshape(fermi_levels.shape)
+        
+        if fermi_levels.ndim == 0:
+            return float(h) , float(n)
+        return h , n
 
 
     def carrier_concentrations_total(self,chemical_potentials,bulk_dos,temperature=300,fermi_level=0.):
@@ -282,33 +1440,31 @@ class DefectsAnalysis:
         Args:
             chemical_potentials: dict of chemical potentials to use for calculation fermi level
             bulk_dos: bulk system dos (pymatgen Dos object)
-            temperature: Temperature to equilibrate fermi energies for
-            fermi_level: (float) is fermi level relative to valence band maximum
+            temperature: (float or array) Temperature to equilibrate fermi energies for
+            fermi_level: (float or array) is fermi level relative to valence band maximum
                 Default efermi = 0 = VBM energy         
+            Arrays of temperatures and Fermi levels are broadcasted against each other.
         Returns:
             total positive charge concentration ,total negative charge concentration in absolute values
+            (float or arrays with the broadcasted shape)
         """
-                
-        ef = fermi_level
-
-        qd_negative = sum([
-            d['charge'] * d['conc']
-            for d in self.defect_concentrations(
-                chemical_potentials=chemical_potentials, temperature=temperature, fermi_level=ef)
-            if d['charge'] < 0
-            ])
-        
-        qd_positive = sum([
-            d['charge'] * d['conc']
-            for d in self.defect_concentrations(
-                chemical_potentials=chemical_potentials, temperature=temperature, fermi_level=ef)
-            if d['charge'] > 0
-            ])
-        h, n = self.carrier_concentrations_intrinsic(bulk_dos,temperature=temperature,fermi_level=ef)
-        
-        qtot_positive = abs(qd_positive) + h
-        qtot_negative = abs(qd_negative) + n
+        packed = self._get_packed_entries()
+        intercepts = self.formation_energies_array(chemical_potentials,fermi_levels=0)
+        fermi_levels, temperatures = np.broadcast_arrays(np.asarray(fermi_level,dtype=float),
+                                                         np.asarray(temperature,dtype=float))
+        q_defects = np.zeros((fermi_levels.size,2))
+        chunk_size = 1000
+        for start in range(0,fermi_levels.size,chunk_size):
+            ef = fermi_levels.ravel()[start:start+chunk_size]
+            q_defects[start:start+chunk_size] = get_defects_charge_array(packed['charges'],np.broadcast_to(intercepts,(len(ef),len(intercepts))),
+                                                                         packed['site_densities'],ef,temperatures.ravel()[start:start+chunk_size])[0]
+        h, n = self.carrier_concentrations_intrinsic(bulk_dos,temperature=temperatures,fermi_level=fermi_levels)
+
+        qtot_positive = q_defects[:,0].reshape(fermi_levels.shape) + h
+        qtot_negative = q_defects[:,1].reshape(fermi_levels.shape) + n
 
+        if fermi_levels.ndim == 0:
+            return float(qtot_positive) , float(qtot_negative)
         return qtot_positive , qtot_negative
     
 
@@ -336,9 +1492,10 @@ class DefectsAnalysis:
         
         Parameters
         ----------
-        frozen_defect_concentrations : (list)
+        frozen_defect_concentrations : (list or ndarray)
             List of defect concentrations. Most likely generated with the defect_concentrations() method. It is not
-            recommended to generate this manually.
+            recommended to generate this manually. Can also be the array of concentrations generated with 
+            defect_concentrations_array(), aligned with defect_entries.
         chemical_potentials : (Dict)
             Dictionary of chemical potentials in the format {Element('el'):chempot}.
         bulk_dos : (CompleteDos object)
@@ -355,64 +1512,14 @@ class DefectsAnalysis:
         qtot_positive, qtot_negative (float,float)
             Absolute value of total positive and negative charge concentrations
         """
-        ef = fermi_level        
-        fdos = FermiDosCarriersInfo(bulk_dos, bandgap=self.band_gap)
-        _,fdos_vbm = fdos.get_cbm_vbm()
-        
-        c_tot_frozen = {}       
-        for d in frozen_defect_concentrations:
-            name = d['name']
-            if name in self.names():           
-                if name not in c_tot_frozen:
-                    c_tot_frozen[name] = d['conc']
-                else:
-                    c_tot_frozen[name] += d['conc']
-            else:
-                print(f'Warning: Frozen defect named "{name}" is not in the list of computed defects and will not contribute to the calculation')
-        
-        for name in self.names():
-            if name not in c_tot_frozen:
-                c_tot_frozen[name] = 0 #if specie is not frozen its contribution in the sum with frozen defects is 0
-            
-            # defect concentrations that depend on ef
-            conc_ef = self.defect_concentrations(chemical_potentials=chemical_potentials, temperature=temperature, fermi_level=ef)
-            
-            c_tot_specie = {}
-            for name in self.names():
-                c_tot_specie[name] = 0
-                for d in conc_ef:
-                    if d['name'] == name:
-                        c_tot_specie[name] += d['conc']
-            
-        qd_positive=0
-        qd_negative=0
-        #frozen defects - D1
-        for d in conc_ef:
-            if c_tot_frozen[d['name']] != 0 and c_tot_specie[d['name']] > 1e-250: #if smaller then 1e-300 you get division by zero Error
-                if d['charge'] > 0:
-                    qd_positive += d['charge'] * (1/c_tot_specie[d['name']]) * d['conc'] * c_tot_frozen[d['name']]
-                elif d['charge'] < 0:
-                    qd_negative += d['charge'] * (1/c_tot_specie[d['name']]) * d['conc'] * c_tot_frozen[d['name']]
-        
-        # normal defects - D2
-        for d in conc_ef:
-            if c_tot_frozen[d['name']] == 0:
-                if d['charge'] > 0:
-                    qd_positive += d['charge']*d['conc']
-                elif d['charge'] < 0:
-                    qd_negative += d['charge']*d['conc'] 
-
-        #external fixed defects - D3
-        for d_ext in external_defects:
-            if d['charge'] > 0:
-                qd_positive += d_ext['charge']*d_ext['conc']
-            elif d['charge'] < 0:
-                qd_negative += d_ext['charge']*d_ext['conc']
-        
-        h, n = self.carrier_concentrations_intrinsic(bulk_dos,temperature=temperature,fermi_level=ef)
-
-        qtot_positive = abs(qd_positive + h)
-        qtot_negative = abs(qd_negative + n)
+        packed = self._get_packed_entries()
+        intercepts = self.formation_energies_array(chemical_potentials,fermi_levels=0)
+        frozen_totals, external_charges = self._get_non_eq_groups(frozen_defect_concentrations,external_defects)
+        
+        q_defects, _ = get_defects_charge_array(packed['charges'],intercepts[np.newaxis],packed['site_densities'],[fermi_level],[temperature],
+                                                packed['entry_names'],frozen_totals[np.newaxis],external_charges)
+        q_carriers, _ = get_carriers_charge_array(self._get_band_arrays(bulk_dos),[fermi_level],[temperature])
+        qtot_positive, qtot_negative = q_defects[0] + q_carriers[0]
 
         return qtot_positive , qtot_negative
     
@@ -441,12 +1548,16 @@ class DefectsAnalysis:
     
     
     
-    def charge_transition_levels(self, energy_range=None):
+    def charge_transition_levels(self, energy_range=None, mode='analytic'):
         """
         Computes charge transition levels for all defect entries
         Args:
             energy_range (Tuple): Energy range to evaluate the charge transition levels in
-                                  default to (-0.5, Eg + 0.5)                  
+                                  default to (-0.5, Eg + 0.5)
+            mode (str): "analytic" computes the exact transition levels from the lower envelope
+                        of the formation energy lines of every defect. "grid" finds the changes 
+                        of the stable charge on a grid of 1000 points in the energy range. 
+                        Default is "analytic".
         Returns:
             Dictionary with defect name and list of tuples for charge transition levels:
                 {name:[(q1,q2,ctl),(q2,q3,ctl),...}
@@ -460,21 +1571,31 @@ class DefectsAnalysis:
         if energy_range == None:
             energy_range = (-0.5,self.band_gap +0.5)
         
-        # creating energy array
-        npoints = 1000
-        step = abs(energy_range[1]-energy_range[0])/npoints
-        e = np.arange(energy_range[0],energy_range[1],step)
-        
-        # starting point is first E value
-        previous_stable_charges = self.stable_charges(None,fermi_level=energy_range[0])
-        for i in range(0,len(e)):
-            stable_charges = self.stable_charges(None, fermi_level = e[i])
-            for name in stable_charges:
-                new_charge = stable_charges[name][0]
-                previous_charge = previous_stable_charges[name][0]
-                if new_charge != previous_charge:
-                    previous_stable_charges = stable_charges
+        if mode == 'analytic':
+            for name,envelope in self.formation_energy_envelopes(None,energy_range).items():
+                indexes = envelope['entry_indexes']
+                for i,transition in enumerate(envelope['transitions']):
+                    previous_charge = self.defect_entries[indexes[i]].charge
+                    new_charge = self.defect_entries[indexes[i+1]].charge
+                    charge_transition_levels[name].append((previous_charge,new_charge,transition))
+        
+        elif mode == 'grid':
+            # creating energy array
+            npoints = 1000
+            step = abs(energy_range[1]-energy_range[0])/npoints
+            e = np.arange(energy_range[0],energy_range[1],step)
+            
+            # stable entries for every name at every energy value
+            stable_indexes = self._get_stable_indexes(self.formation_energies_array(None,fermi_levels=e))
+            charges = self._get_packed_entries()['charges'][stable_indexes]
+            for j,name in enumerate(self.names()):
+                for i in np.flatnonzero(charges[1:,j] != charges[:-1,j]) + 1:
+                    previous_charge = self.defect_entries[stable_indexes[i-1,j]].charge
+                    new_charge = self.defect_entries[stable_indexes[i,j]].charge
                     charge_transition_levels[name].append((previous_charge,new_charge,e[i]))
+        
+        else:
+            raise ValueError('mode must be "analytic" or "grid"')
                             
         return charge_transition_levels
     
@@ -490,19 +1611,39 @@ class DefectsAnalysis:
         returns:
             list of dictionaries of defect concentrations
         """
-        concentrations = []
-        for dfct in self.defect_entries:
-            concentrations.append({
-                'conc':
-                dfct.defect_concentration(
-                    self.vbm, chemical_potentials=chemical_potentials, temperature=temperature, fermi_level=fermi_level),
-                'name':
-                dfct.name,
-                'charge':
-                dfct.charge
-            })
+        conc = self.defect_concentrations_array(chemical_potentials,temperature,fermi_level)[0]
+        return self._get_concentrations_dicts(conc)
+    
+    
+    def defect_concentrations_array(self, chemical_potentials, temperature=300, fermi_levels=0.):
+        """
+        Concentrations of all defect entries as arrays, without building dictionaries. 
+        Entries follow the order of defect_entries.
+
+        Parameters
+        ----------
+        chemical_potentials : (dict, list, Reservoirs or ndarray)
+            Chemical potentials, see formation_energies_array().
+        temperature : (float or ndarray), optional
+            Temperature in K, needs to be broadcastable with the formation energies without the
+            last axis. The default is 300.
+        fermi_levels : (float or ndarray), optional
+            Fermi level or array of Fermi levels relative to the vbm. The default is 0.
 
-        return concentrations
+        Returns
+        -------
+        concentrations : (ndarray)
+            Concentrations in cm^-3 with shape (chempots batch shape) + (Fermi levels shape) + (number of entries,).
+        entry_names : (ndarray)
+            Index of the name of every entry in the list given by names().
+        charges : (ndarray)
+            Charge of every entry.
+        """
+        packed = self._get_packed_entries()
+        energies = self.formation_energies_array(chemical_potentials,fermi_levels=fermi_levels)
+        temperature = np.asarray(temperature,dtype=float)[...,np.newaxis]
+        concentrations = packed['site_densities'] * np.exp(-1.0 * energies / (kb * temperature))
+        return concentrations, packed['entry_names'], packed['charges']
     
 
     def defect_concentrations_stable_charges(self, chemical_potentials, temperature=300, fermi_level=0.):
@@ -523,16 +1664,12 @@ class DefectsAnalysis:
         conc_stable : (list)
             List of dictionaries with concentrations of defects with stable charge states at a given efermi.
         """
-        concentrations = self.defect_concentrations(chemical_potentials,temperature=temperature,fermi_level=fermi_level)
-        stable_charges = self.stable_charges(chemical_potentials,fermi_level=fermi_level)
-        conc_stable = []
-        for c in concentrations:
-            n = c['name']
-            q = c['charge']
-            for name in stable_charges:
-                charge = stable_charges[name][0]
-                if n == name and q == charge:
-                    conc_stable.append(c)
+        conc, entry_names, charges = self.defect_concentrations_array(chemical_potentials,temperature,fermi_level)
+        energies = self.formation_energies_array(chemical_potentials,fermi_levels=fermi_level)
+        stable_indexes = self._get_stable_indexes(energies)
+        # all entries with the same name and charge of the most stable entry are included
+        is_stable = charges == charges[stable_indexes][entry_names]
+        conc_stable = self._get_concentrations_dicts(conc,np.flatnonzero(is_stable))
         return conc_stable
 
 
@@ -556,18 +1693,23 @@ class DefectsAnalysis:
 
         """
         
-        total_concentrations = {}
-        for name in self.names():
-            total_concentrations[name] = 0
-            for d in self.defect_concentrations(chemical_potentials=chemical_potentials,
-                                                temperature=temperature,fermi_level=fermi_level):
-                if d['name'] == name:
-                    total_concentrations[name] += d['conc']
+        packed = self._get_packed_entries()
+        conc, entry_names = self.defect_concentrations_array(chemical_potentials,temperature,fermi_level)[:2]
+        totals = np.bincount(entry_names,weights=conc,minlength=len(packed['names']))
+        total_concentrations = {name:total for name,total in zip(packed['names'],totals)}
         
         return total_concentrations
                     
             
-    def equilibrium_fermi_level(self, chemical_potentials, bulk_dos, temperature = 300):
+    def elements(self):
+        """
+        Returns a list with all the elements (Element objects) in the delta_atoms of defect entries.
+        This is the order used for the arrays of chemical potentials.
+        """
+        return list(self._get_packed_entries()['elements'])
+    
+    
+    def equilibrium_fermi_level(self, chemical_potentials, bulk_dos, temperature = 300, xtol=1e-12, get_stats=False):
         """
         Solve for the Fermi energy self-consistently as a function of T
         Observations are Defect concentrations, electron and hole conc
@@ -575,29 +1717,32 @@ class DefectsAnalysis:
             temperature: Temperature to equilibrate fermi energies for
             chemical_potentials: dict of chemical potentials to use for calculation fermi level
             bulk_dos: bulk system dos (pymatgen Dos object)
+            xtol: absolute tolerance on the Fermi level
+            get_stats: if True a dict with the iteration statistics of the solver is also returned
         Returns:
             Fermi energy dictated by charge neutrality
         """
 
-        fdos = FermiDos(bulk_dos, bandgap=self.band_gap)
-        _,fdos_vbm = fdos.get_cbm_vbm()
+        band_arrays = self._get_band_arrays(bulk_dos)
+        packed = self._get_packed_entries()
+        intercepts = self.formation_energies_array(chemical_potentials,fermi_levels=0)
 
-        def _get_total_q(ef):
+        def _get_total_log_q(ef):
+            log_q, dlog_q = get_total_log_charge(packed['charges'],intercepts[np.newaxis],packed['site_densities'],band_arrays,
+                                                 [ef],[temperature])
+            # positive and negative charges
+            return log_q[0] , dlog_q[0]
 
-            qd_tot = sum([
-                d['charge'] * d['conc']
-                for d in self.defect_concentrations(
-                    chemical_potentials=chemical_potentials, temperature=temperature, fermi_level=ef)
-            ])
-            qd_tot += fdos.get_doping(fermi_level=ef + fdos_vbm, temperature=temperature)
-            return qd_tot
-
-        return bisect(_get_total_q, -1., self.band_gap + 1.)
+        fermi_level, stats = solve_neutrality(_get_total_log_q, -1., self.band_gap + 1., xtol=xtol)
+        if get_stats:
+            return fermi_level, stats
+        else:
+            return fermi_level
             
 
 
     def non_equilibrium_fermi_level(self, frozen_defect_concentrations, chemical_potentials, bulk_dos, 
-                                        external_defects=[], temperature=300):
+                                        external_defects=[], temperature=300, xtol=1e-12, get_stats=False):
         """
         Solve charge neutrality in non-equilibrium conditions. The contribution to the total charge concentration
         of the defects can arise from 3 different contributions (groups):
@@ -620,9 +1765,10 @@ class DefectsAnalysis:
         
         Parameters
         ----------
-        frozen_defect_concentrations : (list)
+        frozen_defect_concentrations : (list or ndarray)
             List of defect concentrations. Most likely generated with the defect_concentrations() method. It is not
-            recommended to generate this manually.
+            recommended to generate this manually. Can also be the array of concentrations generated with 
+            defect_concentrations_array(), aligned with defect_entries.
         chemical_potentials : (Dict)
             Dictionary of chemical potentials in the format {Element('el'):chempot}.
         bulk_dos : (CompleteDos object)
@@ -631,6 +1777,10 @@ class DefectsAnalysis:
             List of external defect concentrations (not present in defect entries).
         temperature : (float), optional
             Temperature to equilibrate the system to. The default is 300.
+        xtol : (float), optional
+            Absolute tolerance on the Fermi level. The default is 1e-12.
+        get_stats : (bool), optional
+            Return also a dict with the iteration statistics of the solver. The default is False.
 
         Returns
         -------
@@ -638,56 +1788,24 @@ class DefectsAnalysis:
             Fermi level dictated by charge neutrality .
         """
         
-        fdos = FermiDosCarriersInfo(bulk_dos, bandgap=self.band_gap)
-        _,fdos_vbm = fdos.get_cbm_vbm()
+        band_arrays = self._get_band_arrays(bulk_dos)
+        packed = self._get_packed_entries()
+        intercepts = self.formation_energies_array(chemical_potentials,fermi_levels=0)
         
-        c_tot_frozen = {}       
-        for d in frozen_defect_concentrations:
-            name = d['name']
-            if name in self.names():           
-                if name not in c_tot_frozen:
-                    c_tot_frozen[name] = d['conc']
-                else:
-                    c_tot_frozen[name] += d['conc']
-            else:
-                print(f'Warning: Frozen defect named "{name}" is not in the list of computed defects and will not contribute to the calculation')
-        
-        for name in self.names():
-            if name not in c_tot_frozen:
-                c_tot_frozen[name] = 0 #if specie is not frozen its contribution in the sum with frozen defects is 0
-
-        def _get_total_q(ef):
-            
-            # defect concentrations that depend on ef
-            conc_ef = self.defect_concentrations(chemical_potentials=chemical_potentials, temperature=temperature, fermi_level=ef)
-            
-            c_tot_specie = {}
-            for name in self.names():
-                c_tot_specie[name] = 0
-                for d in conc_ef:
-                    if d['name'] == name:
-                        c_tot_specie[name] += d['conc']
-            
-            qd_tot=0
-            #frozen defects - D1
-            for d in conc_ef:
-                if c_tot_frozen[d['name']] != 0 and c_tot_specie[d['name']] > 1e-250: #if smaller then 1e-300 you get division by zero Error
-                    qd_tot += d['charge'] * (1/c_tot_specie[d['name']]) * d['conc'] * c_tot_frozen[d['name']]
-            
-            # normal defects - D2
-            for d in conc_ef:
-                if c_tot_frozen[d['name']] == 0:
-                    qd_tot += d['charge']*d['conc']
-
-            #external fixed defects - D3
-            for d_ext in external_defects:
-                qd_tot += d_ext['charge']*d_ext['conc']
-                
-            qd_tot += fdos.get_doping(fermi_level=ef + fdos_vbm, temperature=temperature)
+        # species that are not frozen have total concentration 0 and are treated as normal defects
+        frozen_totals, external_charges = self._get_non_eq_groups(frozen_defect_concentrations,external_defects)
 
-            return qd_tot
+        def _get_total_log_q(ef):
+            log_q, dlog_q = get_total_log_charge(packed['charges'],intercepts[np.newaxis],packed['site_densities'],band_arrays,
+                                                 [ef],[temperature],packed['entry_names'],frozen_totals[np.newaxis],external_charges)
+            # positive and negative charges
+            return log_q[0] , dlog_q[0]
                        
-        return bisect(_get_total_q, -1., self.band_gap + 1.)
+        fermi_level, stats = solve_neutrality(_get_total_log_q, -1., self.band_gap + 1., xtol=xtol)
+        if get_stats:
+            return fermi_level, stats
+        else:
+            return fermi_level
 
     
     def formation_energies(self,chemical_potentials,fermi_level=0):
@@ -705,16 +1823,133 @@ class DefectsAnalysis:
             {name: [(charge,formation energy)] }
         """
 
+        energies = self.formation_energies_array(chemical_potentials,fermi_levels=fermi_level)
         computed_charges = {}
-        for d in self.defect_entries:
+        for d,energy in zip(self.defect_entries,energies):
             name = d.name
             if name in computed_charges:
-                computed_charges[name].append((d.charge,d.formation_energy(self.vbm,chemical_potentials,fermi_level=fermi_level)))
+                computed_charges[name].append((d.charge,energy))
             else:
                 computed_charges[name] = []
-                computed_charges[name].append((d.charge,d.formation_energy(self.vbm,chemical_potentials,fermi_level=fermi_level)))
+                computed_charges[name].append((d.charge,energy))
         
         return computed_charges
+    
+    
+    def formation_energies_array(self,chemical_potentials,fermi_levels=0):
+        """
+        Compute the formation energies of all defect entries for a batch of chemical potentials
+        and a grid of Fermi levels with a single broadcasted expression:
+            E_form = energy_diff + corrections + q*(vbm + E_F) - delta_atoms * mu 
+
+        Parameters
+        ----------
+        chemical_potentials : (dict, list, Reservoirs or ndarray)
+            Single dictionary of chemical potentials ({Element:chempot}), collection of dictionaries 
+            (list or Reservoirs) or array with elements ordered as in elements() on the last axis.
+            If None chemical potentials are not included.
+        fermi_levels : (float or ndarray), optional
+            Fermi level or array of Fermi levels relative to the vbm. The default is 0.
+
+        Returns
+        -------
+        formation_energies : (ndarray)
+            Array with shape (chempots batch shape) + (Fermi levels shape) + (number of entries,).
+            The last axis follows the order of defect_entries.
+        """
+        packed = self._get_packed_entries()
+        charges = packed['charges']
+        chempots = self.get_chempots_array(chemical_potentials)
+        fermi_levels = np.asarray(fermi_levels,dtype=float)
+        
+        intercepts = self._get_intercepts(chempots)
+        intercepts = intercepts.reshape(chempots.shape[:-1] + (1,)*fermi_levels.ndim + (len(charges),))
+        
+        return intercepts + fermi_levels[...,np.newaxis] * charges
+    
+    
+    def formation_energy_envelopes(self,chemical_potentials=None,energy_range=None):
+        """
+        Exact lower envelope of the formation energies as a function of the Fermi level for every defect name. 
+        The envelope is a piecewise-linear function, segments correspond to the stable charge states.
+
+        Parameters
+        ----------
+        chemical_potentials : (dict), optional
+            Dictionary of chemical potentials ({Element:chempot}). The default is None (chempots not included).
+        energy_range : (tuple), optional
+            Range of Fermi levels (min,max) relative to the vbm. The default is None ((-0.5, Eg + 0.5)).
+
+        Returns
+        -------
+        envelopes : (dict)
+            Dictionary with defect names as keys and dictionaries as values with the following keys:
+                - "entry_indexes" : array with the indexes of the stable entries from low to high Fermi level
+                - "charges" : array with the charges of the stable entries
+                - "transitions" : array with the charge transition levels in the energy range 
+                                  (len(transitions) = len(charges) - 1)
+                - "vertices" : array (len(charges) + 1, 2) with Fermi levels and formation energies of the
+                               vertices of the envelope, including the limits of the energy range
+        """
+        if energy_range is None:
+            energy_range = (-0.5,self.band_gap +0.5)
+        
+        packed = self._get_packed_entries()
+        intercepts = self.formation_energies_array(chemical_potentials,fermi_levels=0)
+        envelopes = {}
+        for name,(indexes,transitions) in self._get_lower_envelopes(chemical_potentials).items():
+            # segments overlapping the energy range
+            first = np.searchsorted(transitions,energy_range[0],side='left')
+            last = np.searchsorted(transitions,energy_range[1],side='right')
+            indexes, transitions = indexes[first:last+1], transitions[first:last]
+            x = np.concatenate(([energy_range[0]],transitions,[energy_range[1]]))
+            segments = np.append(indexes,indexes[-1])
+            y = intercepts[segments] + packed['charges'][segments]*x
+            envelopes[name] = {
+                'entry_indexes':indexes,
+                'charges':packed['charges'][indexes],
+                'transitions':transitions,
+                'vertices':np.stack([x,y],axis=-1)
+                }
+        
+        return envelopes
+    
+    
+    def get_chempots_array(self,chemical_potentials):
+        """
+        Convert chemical potentials to an array with the elements ordered as in elements().
+
+        Parameters
+        ----------
+        chemical_potentials : (dict, list, Reservoirs or ndarray)
+            Single dictionary of chemical potentials ({Element:chempot}), collection of dictionaries 
+            (list or Reservoirs) or array with elements ordered as in elements() on the last axis.
+            If None all chemical potentials are set to 0.
+
+        Returns
+        -------
+        chempots : (ndarray)
+            Array of shape (number of elements,) for a single dictionary, (number of dictionaries,number of elements) 
+            for a collection of dictionaries.
+        """
+        elements = self._get_packed_entries()['elements']
+        if chemical_potentials is None:
+            return np.zeros(len(elements))
+        elif isinstance(chemical_potentials,np.ndarray):
+            if chemical_potentials.shape[-1] != len(elements):
+                raise ValueError(f'Last dimension of chemical potentials array must be equal to the number of elements ({len(elements)})')
+            return chemical_potentials.astype(float)
+        
+        if hasattr(chemical_potentials,'values'):
+            values = list(chemical_potentials.values())
+            if values and isinstance(values[0],dict): # dict of reservoirs or Reservoirs object
+                chemical_potentials = values
+            elif values:
+                return np.array([chemical_potentials[el] for el in elements],dtype=float)
+            else:
+                return np.zeros(len(elements))
+        
+        return np.array([self.get_chempots_array(mu) for mu in chemical_potentials]).reshape(-1,len(elements))
    
     
     def names(self):
@@ -722,12 +1957,7 @@ class DefectsAnalysis:
         Returns a list with all the different names of defect entries
         """
         
-        names = []
-        for d in self.defect_entries:
-            if d.name not in names:
-                names.append(d.name)
-        
-        return names
+        return list(self._get_packed_entries()['names'])
             
     
     def plot(self,mu_elts=None,xlim=None, ylim=None, title=None, fermi_level=None, 
@@ -767,21 +1997,14 @@ class DefectsAnalysis:
         
         matplotlib.rcParams.update({'font.size': 10*fontsize})
         
-        # creating a dictionary with names of single defect entry as keys and
-        # a list of tuples (charge,formation_energy) as values
-        # Every defect name identifies a type of defect
-        computed_charges = self.formation_energies(mu_elts,fermi_level=0)
+        names = self._get_packed_entries()['names']
         # sort by alphabetical order of name for the plot
         if order_legend:
-            computed_charges = {k: v for k, v in sorted(computed_charges.items(), key=lambda item: item[0])}
+            names = sorted(names)
                 
         if xlim == None:
             xlim = (-0.5,self.band_gap+0.5)
         
-        npoints = 200
-        step = abs(xlim[1]+0.1-xlim[0])/npoints
-        x = np.arange(xlim[0],xlim[1]+0.1,step)
-
         try:
             if len(plotsize)==2:
                 pass
@@ -797,28 +2020,13 @@ class DefectsAnalysis:
             plt.figure(figsize=(8*plotsize[0],6*plotsize[1]))
             plt.grid()
             
-        for name in computed_charges:
-            energy = np.zeros(len(x))
-            emin = np.zeros(len(x))
-            x_star = []
-            y_star = []
-            q_previous = None
-            for i in range(0,npoints):
-                emin[i] = 1e40
-                for d in computed_charges[name]:
-                    q = d[0]
-                    e0 = d[1]
-                    energy[i] = e0 + q*x[i] # Eform(x) = Eform(0) + q*x
-                    # finding most stable charge state
-                    if energy[i] < emin[i]:
-                        emin[i] = energy[i]
-                        q_stable = q
-                # getting data to plot transition levels        
-                if q_stable != q_previous:
-                    if q_previous != None:
-                        x_star.append(x[i])
-                        y_star.append(emin[i])
-                    q_previous = q_stable
+        # exact piecewise-linear envelopes of the formation energies
+        envelopes = self.formation_energy_envelopes(mu_elts,energy_range=(xlim[0],xlim[1]+0.1))
+        
+        for name in names:
+            vertices = envelopes[name]['vertices']
+            # transition levels are the inner vertices
+            x_star, y_star = vertices[1:-1,0], vertices[1:-1,1]
        
             # if format_legend is True get latex-like legend
             if format_legend:
@@ -841,7 +2049,7 @@ class DefectsAnalysis:
             else:
                 label_txt = name
                 
-            plt.plot(x,emin,label=label_txt,linewidth=3)
+            plt.plot(vertices[:,0],vertices[:,1],label=label_txt,linewidth=3)
             plt.scatter(x_star,y_star,s=120,marker='*')
                         
         plt.axvline(x=0.0, linestyle='-', color='k', linewidth=2)  # black dashed lines for gap edges
@@ -892,12 +2100,10 @@ class DefectsAnalysis:
             xlim = (-0.5,self.band_gap+0.5)
         # building array for x values (fermi level)    
         ef = np.arange(xlim[0],xlim[1]+0.1,(xlim[1]-xlim[0])/200)        
-        binding_energy = np.zeros(len(ef))
         
         # getting binding energy at different fermi levels for every name in list
-        for name in names:
-            for i in range(0,len(ef)):
-                binding_energy[i] = self.binding_energy(name,fermi_level=ef[i])            
+        binding_energies = self.binding_energies(ef,names=names)
+        for name,binding_energy in zip(names,binding_energies):
             plt.plot(ef,binding_energy, linewidth=2.5*size,label=name)
             
         plt.axvline(x=0.0, linestyle='-', color='k', linewidth=2)  # black dashed lines for gap edges
@@ -1015,6 +2221,395 @@ class DefectsAnalysis:
         return plt
     
     
+    def remove_entries(self, entries):
+        """
+        Remove defect entries. Packed arrays and indexes of the entries are updated incrementally and 
+        the cached formation energies are reduced to the remaining entries. Only the lower envelopes and
+        the single defects (constituents) of the defect names that are affected by the removed entries 
+        are recomputed. Names without entries are removed from names(), the order of the others is kept.
+
+        Parameters
+        ----------
+        entries : (list)
+            Entries to remove (objects in defect_entries) or their indexes in defect_entries.
+        """
+        packed = self._get_packed_entries()
+        keep = np.ones(len(packed['charges']),dtype=bool)
+        keep[self._get_entry_indexes(entries)] = False
+        # new position of the remaining entries
+        positions = np.cumsum(keep) - 1
+        
+        if isinstance(self._defect_entries,DefectEntrySet):
+            defect_entries = self._defect_entries.select(keep)
+            arrays = self._get_entries_arrays(defect_entries)
+        else:
+            defect_entries = [entry for entry,k in zip(self._defect_entries,keep) if k]
+            used_names = np.unique(packed['entry_names'][keep])
+            name_positions = np.zeros(len(packed['names']),dtype=int)
+            name_positions[used_names] = np.arange(len(used_names))
+            used_elements = packed['delta_atoms_mask'][keep].any(axis=0)
+            arrays = {key:packed[key][keep] for key in ('charges','energies','site_densities')}
+            arrays.update({
+                'delta_atoms':packed['delta_atoms'][keep][:,used_elements],
+                'delta_atoms_mask':packed['delta_atoms_mask'][keep][:,used_elements],
+                'elements':[el for el,used in zip(packed['elements'],used_elements) if used],
+                'names':[packed['names'][i] for i in used_names],
+                'entry_names':name_positions[packed['entry_names'][keep]]
+                })
+        
+        def _update_indexes(indexes):
+            return positions[indexes[keep[indexes]]]
+        
+        name_indexes = [_update_indexes(packed['name_indexes'][packed['name_positions'][name]]) for name in arrays['names']]
+        charge_indexes = {q:_update_indexes(indexes) for q,indexes in packed['charge_indexes'].items()}
+        charge_indexes = {q:indexes for q,indexes in charge_indexes.items() if len(indexes) > 0}
+        element_indexes = {el:_update_indexes(packed['element_indexes'][el]) for el in arrays['elements']}
+        
+        # names of the removed entries and defects made of them
+        removed_names = {packed['names'][i] for i in np.unique(packed['entry_names'][~keep])}
+        updated_names = set(removed_names)
+        for name in arrays['names']:
+            if any(single in removed_names for single,n in packed['constituents'][name]):
+                updated_names.add(name)
+        
+        self._defect_entries = defect_entries
+        self._set_packed_entries(defect_entries,arrays,name_indexes,charge_indexes,element_indexes,updated_names,packed)
+        
+        if len(arrays['elements']) != len(packed['elements']):
+            # cache keys depend on the number of elements
+            self._intercepts_cache.clear()
+            self._envelopes_cache.clear()
+        else:
+            for key,intercepts in self._intercepts_cache.items():
+                self._intercepts_cache[key] = intercepts[keep]
+                self._intercepts_cache[key].flags.writeable = False
+            for envelopes in self._envelopes_cache.values():
+                for name in list(envelopes):
+                    if name in removed_names:
+                        envelopes.pop(name)
+                    else:
+                        indexes, transitions = envelopes[name]
+                        envelopes[name] = (positions[indexes],transitions)
+        return
+                
+
+    def sample_equilibrium(self, chemical_potentials, bulk_dos, temperature=300, nsamples=1000, energy_std=0.,
+                           corrections_std=0., vbm_std=0., band_gap_std=0., chempots_std=0., 
+                           quantiles=(0.025,0.5,0.975), seed=None, xtol=1e-12, chunk_size=1000, processes=1):
+        """
+        Propagate the uncertainties of the input quantities to the equilibrium Fermi level, carrier
+        and defect concentrations with Monte Carlo sampling. Energies of the entries, corrections, vbm, 
+        band gap and chemical potentials are perturbed with normally distributed errors, then the charge
+        neutrality of all samples is solved as a single vectorized problem.
+        Perturbations of the band gap are applied as rigid shifts of the conduction band.
+
+        Parameters
+        ----------
+        chemical_potentials : (dict)
+            Dictionary of chemical potentials in the format {Element('el'):chempot}.
+        bulk_dos : (CompleteDos object)
+            Pymatgen CompleteDos object of the DOS of the bulk system.
+        temperature : (float), optional
+            Temperature in K. The default is 300.
+        nsamples : (int), optional
+            Number of samples. The default is 1000.
+        energy_std : (float or array), optional
+            Standard deviation of energy_diff, single value or one value for every entry. The default is 0.
+        corrections_std : (float or array), optional
+            Standard deviation of the sum of the corrections, single value or one value for every entry. 
+            The default is 0.
+        vbm_std : (float), optional
+            Standard deviation of the vbm. The default is 0.
+        band_gap_std : (float), optional
+            Standard deviation of the band gap. The default is 0.
+        chempots_std : (float or dict), optional
+            Standard deviation of the chemical potentials, single value or dictionary {Element:std}. The default is 0.
+        quantiles : (tuple), optional
+            Quantiles to compute. The default is (0.025,0.5,0.975).
+        seed : (int), optional
+            Seed of the random number generator, results are reproducible if set. The default is None.
+        xtol : (float), optional
+            Absolute tolerance on the Fermi level. The default is 1e-12.
+        chunk_size : (int), optional
+            Number of samples solved together. The default is 1000.
+        processes : (int), optional
+            Number of worker processes. If different from 1 chunks are solved on a pool of processes 
+            (see solve_grid_parallel()), None uses all CPUs. The default is 1.
+
+        Returns
+        -------
+        results : (dict)
+            Dictionary with the following keys:
+                - "fermi_levels", "holes", "electrons" : (nsamples,) values for every sample
+                - "defect_concentrations_total" : (nsamples,names) total concentration of every defect specie
+                - "defect_names" : list with the names of the defect species
+                - "quantiles" : array with the quantiles
+                - "fermi_levels_quantiles", "holes_quantiles", "electrons_quantiles" : (quantiles,) arrays 
+                - "defect_concentrations_total_quantiles" : (quantiles,names) array
+                - "chemical_potentials", "vbm", "band_gap" : sampled values of the input quantities
+                - "seed" : seed of the random number generator
+        """
+        packed = self._get_packed_entries()
+        nentries, nelements = len(packed['charges']), len(packed['elements'])
+        rng = np.random.default_rng(seed)
+        if isinstance(chempots_std,dict):
+            chempots_std = self.get_chempots_array(chempots_std)
+        
+        # all perturbations are always drawn, such that samples with the same seed are reproducible
+        energy_errors = rng.normal(0.,1.,(nsamples,nentries)) * np.asarray(energy_std,dtype=float)
+        corrections_errors = rng.normal(0.,1.,(nsamples,nentries)) * np.asarray(corrections_std,dtype=float)
+        vbm_errors = rng.normal(0.,vbm_std,nsamples)
+        band_gap_errors = rng.normal(0.,band_gap_std,nsamples)
+        chempots = self.get_chempots_array(chemical_potentials) + rng.normal(0.,1.,(nsamples,nelements)) * chempots_std
+        
+        intercepts = (self.formation_energies_array(chempots,fermi_levels=0) + energy_errors + corrections_errors
+                      + vbm_errors[:,np.newaxis] * packed['charges'])
+        band_arrays = self._get_band_arrays(bulk_dos)
+        temperatures = np.full(nsamples,temperature,dtype=float)
+        emax = self.band_gap + max(band_gap_errors.max(),0) + 1.
+        
+        if processes == 1:
+            fermi_levels = np.zeros(nsamples)
+            carriers = np.zeros((nsamples,2))
+            concentrations_total = np.zeros((nsamples,len(packed['names'])))
+            for start in range(0,nsamples,chunk_size):
+                chunk = slice(start,start+chunk_size)
+                fermi_levels[chunk], carriers[chunk], concentrations, _ = solve_equilibrium_conditions(
+                    packed['charges'],intercepts[chunk],packed['site_densities'],temperatures[chunk],band_arrays,
+                    -1.,emax,xtol=xtol,cb_shifts=band_gap_errors[chunk])
+                for i,indexes in enumerate(packed['name_indexes']):
+                    concentrations_total[chunk,i] = concentrations[:,indexes].sum(axis=-1)
+        else:
+            arrays = {
+                'charges':packed['charges'],
+                'site_densities':packed['site_densities'],
+                'intercepts':intercepts,
+                'temperatures':temperatures[:1],
+                'cb_shifts':band_gap_errors
+                }
+            arrays.update(band_arrays)
+            settings = {'emin':-1.,'emax':emax,'xtol':xtol,'external_charges':(0,0)}
+            results = run_sharded(arrays,nsamples,settings,chunk_size=chunk_size,processes=processes)
+            fermi_levels, carriers = results['fermi_levels'], results['carriers']
+            concentrations_total = np.stack([results['concentrations'][:,indexes].sum(axis=-1) 
+                                             for indexes in packed['name_indexes']],axis=-1)
+        
+        quantiles = np.asarray(quantiles,dtype=float)
+        results = {
+            'fermi_levels':fermi_levels,
+            'holes':carriers[:,0],
+            'electrons':carriers[:,1],
+            'defect_concentrations_total':concentrations_total,
+            'defect_names':list(packed['names']),
+            'quantiles':quantiles,
+            'fermi_levels_quantiles':np.quantile(fermi_levels,quantiles),
+            'holes_quantiles':np.quantile(carriers[:,0],quantiles),
+            'electrons_quantiles':np.quantile(carriers[:,1],quantiles),
+            'defect_concentrations_total_quantiles':np.quantile(concentrations_total,quantiles,axis=0),
+            'chemical_potentials':chempots,
+            'vbm':self.vbm + vbm_errors,
+            'band_gap':self.band_gap + band_gap_errors,
+            'seed':seed
+            }
+        
+        return results
+    
+    
+    def solve_grid(self, temperatures, chempot_array, bulk_dos, xtol=1e-12, chunk_size=1000):
+        """
+        Solve the charge neutrality for every combination of temperatures and chemical potentials.
+        All the conditions are solved together as a vectorized root finding, split in chunks to
+        bound the memory needed for the integrals over the DOS. Useful for Brouwer diagrams.
+
+        Parameters
+        ----------
+        temperatures : (float or array-like)
+            Temperature or list of temperatures in K.
+        chempot_array : (dict, list, Reservoirs or ndarray)
+            Chemical potentials, see get_chempots_array(). Can be a single dict, a list of dicts, 
+            a Reservoirs object or an array with elements ordered as in elements() on the last axis.
+        bulk_dos : (CompleteDos object)
+            Pymatgen CompleteDos object of the DOS of the bulk system.
+        xtol : (float), optional
+            Absolute tolerance on the Fermi level. The default is 1e-12.
+        chunk_size : (int), optional
+            Number of conditions solved together. The default is 1000.
+
+        Returns
+        -------
+        grid : (dict)
+            Dictionary of arrays, with shapes given for N temperatures and M sets of chemical potentials:
+                - "temperatures" : (N,) temperatures
+                - "chemical_potentials" : (M,elements) chemical potentials, ordered as in "elements"
+                - "elements" : list of Element objects
+                - "fermi_levels" : (N,M) Fermi levels relative to the vbm
+                - "holes" : (N,M) hole concentrations in cm^-3
+                - "electrons" : (N,M) electron concentrations in cm^-3
+                - "defect_concentrations" : (N,M,entries) concentrations of every defect entry in cm^-3
+                - "defect_concentrations_total" : (N,M,names) total concentration of every defect specie in cm^-3
+                - "names" : list with the names of the entries
+                - "charges" : (entries,) charges of the entries
+                - "defect_names" : list with the different names of the defect species
+                - "iterations" : (N,M) number of iterations of the solver
+        """
+        packed = self._get_packed_entries()
+        temperatures = np.atleast_1d(np.asarray(temperatures,dtype=float))
+        chempots = self.get_chempots_array(chempot_array).reshape(-1,len(packed['elements']))
+        intercepts = self.formation_energies_array(chempots,fermi_levels=0)
+        ntemp, nchem, nentries = len(temperatures), len(chempots), len(packed['charges'])
+        
+        band_arrays = self._get_band_arrays(bulk_dos)
+        
+        # conditions are flattened as (temperatures,chempots)
+        temperatures_flat = np.repeat(temperatures,nchem)
+        chempot_indexes = np.tile(np.arange(nchem),ntemp)
+        fermi_levels = np.zeros(ntemp*nchem)
+        iterations = np.zeros(ntemp*nchem,dtype=int)
+        carriers = np.zeros((ntemp*nchem,2))
+        concentrations = np.zeros((ntemp*nchem,nentries))
+        
+        for start in range(0,ntemp*nchem,chunk_size):
+            chunk = np.arange(start,min(start+chunk_size,ntemp*nchem))
+            results = solve_equilibrium_conditions(packed['charges'],intercepts[chempot_indexes[chunk]],packed['site_densities'],
+                                                   temperatures_flat[chunk],band_arrays,-1.,self.band_gap + 1.,xtol=xtol)
+            fermi_levels[chunk], carriers[chunk], concentrations[chunk], iterations[chunk] = results
+        
+        return self._get_grid_dict(temperatures,chempots,fermi_levels,carriers,concentrations,iterations)
+            
+    
+    def solve_grid_parallel(self, temperatures, chempot_array, bulk_dos, frozen_temperature=None, external_defects=[],
+                            xtol=1e-12, chunk_size=100, processes=None, progress=None):
+        """
+        Solve the charge neutrality for every combination of temperatures and chemical potentials
+        on a pool of processes. Packed arrays of the defect entries and of the DOS are shipped 
+        to the workers once through shared memory. Results are the same of solve_grid(), in the 
+        same order regardless of the order in which the tasks are completed.
+        If frozen_temperature is set, the total concentrations of the defect species are computed 
+        in equilibrium at frozen_temperature for every set of chemical potentials and kept fixed 
+        (quenched) at the other temperatures, as in non_equilibrium_fermi_level().
+
+        Parameters
+        ----------
+        temperatures : (float or array-like)
+            Temperature or list of temperatures in K.
+        chempot_array : (dict, list, Reservoirs or ndarray)
+            Chemical potentials, see get_chempots_array().
+        bulk_dos : (CompleteDos object)
+            Pymatgen CompleteDos object of the DOS of the bulk system.
+        frozen_temperature : (float), optional
+            Temperature at which defect concentrations are frozen. The default is None (equilibrium).
+        external_defects : (list)
+            List of external defect concentrations (not present in defect entries).
+        xtol : (float), optional
+            Absolute tolerance on the Fermi level. The default is 1e-12.
+        chunk_size : (int), optional
+            Number of conditions in every task. The default is 100.
+        processes : (int), optional
+            Number of worker processes. The default is None (number of CPUs).
+        progress : (function), optional
+            Function called with arguments (completed tasks, total tasks) when a task is completed.
+
+        Returns
+        -------
+        grid : (dict)
+            Dictionary of arrays, see solve_grid().
+        """
+        packed = self._get_packed_entries()
+        temperatures = np.atleast_1d(np.asarray(temperatures,dtype=float))
+        chempots = self.get_chempots_array(chempot_array).reshape(-1,len(packed['elements']))
+        ntemp, nchem = len(temperatures), len(chempots)
+        
+        arrays = {
+            'charges':packed['charges'],
+            'site_densities':packed['site_densities'],
+            'intercepts':self.formation_energies_array(chempots,fermi_levels=0),
+            'temperatures':temperatures
+            }
+        arrays.update(self._get_band_arrays(bulk_dos))
+        if frozen_temperature:
+            frozen = self.solve_grid(frozen_temperature,chempots,bulk_dos,xtol=xtol)
+            arrays['frozen_totals'] = frozen['defect_concentrations_total'][0]
+            arrays['entry_names'] = packed['entry_names']
+        _, external_charges = self._get_non_eq_groups([],external_defects)
+        
+        settings = {'emin':-1.,'emax':self.band_gap + 1.,'xtol':xtol,'external_charges':external_charges}
+        results = run_sharded(arrays,ntemp*nchem,settings,chunk_size=chunk_size,processes=processes,progress=progress)
+        
+        return self._get_grid_dict(temperatures,chempots,results['fermi_levels'],results['carriers'],
+                                   results['concentrations'],results['iterations'])
+
+
+    def solve_quench(self, anneal_temperature, quench_temperatures, chempot_array, bulk_dos, external_defects=[],
+                     xtol=1e-12, chunk_size=1000):
+        """
+        Quench pipeline: defect concentrations are computed in equilibrium at the annealing temperature
+        for every set of chemical potentials, then the total concentrations of all defect species are 
+        kept fixed (frozen) and the charge neutrality is solved again at every quenching temperature,
+        allowing the charge states to re-equilibrate. Same as calling equilibrium_fermi_level() and 
+        non_equilibrium_fermi_level() for every condition, but the frozen totals are computed once 
+        as arrays and all the (quench temperatures x chempots) conditions are solved in a vectorized batch.
+
+        Parameters
+        ----------
+        anneal_temperature : (float)
+            Temperature in K at which the defect concentrations are in equilibrium (and frozen).
+        quench_temperatures : (float or array-like)
+            Temperature or list of temperatures in K after the quench.
+        chempot_array : (dict, list, Reservoirs or ndarray)
+            Chemical potentials, see get_chempots_array().
+        bulk_dos : (CompleteDos object)
+            Pymatgen CompleteDos object of the DOS of the bulk system.
+        external_defects : (list)
+            List of external defect concentrations (not present in defect entries), only used
+            at the quenching temperatures.
+        xtol : (float), optional
+            Absolute tolerance on the Fermi level. The default is 1e-12.
+        chunk_size : (int), optional
+            Number of conditions solved together. The default is 1000.
+
+        Returns
+        -------
+        grid : (dict)
+            Dictionary of arrays for the quenching temperatures, see solve_grid(). Contains also:
+                - "anneal_temperature" : annealing temperature
+                - "anneal_fermi_levels" : (M,) Fermi levels at the annealing temperature
+                - "frozen_concentrations_total" : (M,names) frozen total concentrations in cm^-3
+        """
+        packed = self._get_packed_entries()
+        temperatures = np.atleast_1d(np.asarray(quench_temperatures,dtype=float))
+        chempots = self.get_chempots_array(chempot_array).reshape(-1,len(packed['elements']))
+        ntemp, nchem, nentries = len(temperatures), len(chempots), len(packed['charges'])
+        
+        anneal = self.solve_grid(anneal_temperature,chempots,bulk_dos,xtol=xtol,chunk_size=chunk_size)
+        frozen_totals = anneal['defect_concentrations_total'][0]
+        _, external_charges = self._get_non_eq_groups([],external_defects)
+        intercepts = self.formation_energies_array(chempots,fermi_levels=0)
+        band_arrays = self._get_band_arrays(bulk_dos)
+        
+        # conditions are flattened as (temperatures,chempots)
+        temperatures_flat = np.repeat(temperatures,nchem)
+        chempot_indexes = np.tile(np.arange(nchem),ntemp)
+        fermi_levels = np.zeros(ntemp*nchem)
+        iterations = np.zeros(ntemp*nchem,dtype=int)
+        carriers = np.zeros((ntemp*nchem,2))
+        concentrations = np.zeros((ntemp*nchem,nentries))
+        
+        for start in range(0,ntemp*nchem,chunk_size):
+            chunk = np.arange(start,min(start+chunk_size,ntemp*nchem))
+            results = solve_non_equilibrium_conditions(packed['charges'],intercepts[chempot_indexes[chunk]],packed['site_densities'],
+                                                       temperatures_flat[chunk],band_arrays,-1.,self.band_gap + 1.,
+                                                       packed['entry_names'],frozen_totals[chempot_indexes[chunk]],
+                                                       external_charges,xtol=xtol)
+            fermi_levels[chunk], carriers[chunk], concentrations[chunk], iterations[chunk] = results
+        
+        grid = self._get_grid_dict(temperatures,chempots,fermi_levels,carriers,concentrations,iterations)
+        grid['anneal_temperature'] = anneal_temperature
+        grid['anneal_fermi_levels'] = anneal['fermi_levels'][0]
+        grid['frozen_concentrations_total'] = frozen_totals
+        
+        return grid
+            
+    
     def stable_charges(self,chemical_potentials,fermi_level=0):
         """
         Creating a dictionary with names of single defect entry as keys and
@@ -1031,33 +2626,55 @@ class DefectsAnalysis:
             {name:(stable charge, formation energy)}
        """
         
-        computed_charges = self.formation_energies(chemical_potentials,fermi_level=fermi_level)
+        energies = self.formation_energies_array(chemical_potentials,fermi_levels=fermi_level)
+        stable_indexes = self._get_stable_indexes(energies)
         
         stable_charges = {}
-        for name in computed_charges:
-            emin = 1e40
-            for d in computed_charges[name]:
-                q = d[0]
-                energy = d[1]
-                # finding most stable charge state
-                if energy < emin:
-                    emin = energy
-                    q_stable = q
-            stable_charges[name] = (q_stable,emin)
+        for name,index in zip(self._get_packed_entries()['names'],stable_indexes):
+            stable_charges[name] = (self.defect_entries[index].charge,energies[index])
             
         return stable_charges
-        
-            
-            
-            
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
\ No newline at end of file
+
+
+
+def get_lower_envelope(slopes,intercepts):
+    """
+    Find the lower envelope of a set of lines y = intercept + slope*x over the whole real axis,
+    with a convex-hull-of-lines algorithm (O(n log n)). For defect formation energies the slopes
+    are the charges and the x values are Fermi levels.
+
+    Parameters
+    ----------
+    slopes : (array-like)
+        Slopes of the lines.
+    intercepts : (array-like)
+        Intercepts of the lines (values at x=0).
+
+    Returns
+    -------
+    indexes : (ndarray)
+        Indexes of the lines forming the envelope, ordered from low to high x (decreasing slope).
+        In case of identical lines the first one is taken.
+    transitions : (ndarray)
+        x values of the intersections between consecutive lines of the envelope. 
+    """
+    slopes = np.asarray(slopes,dtype=float)
+    intercepts = np.asarray(intercepts,dtype=float)
+    # decreasing slope, then increasing intercept (stable sort keeps the first of identical lines)
+    order = np.lexsort((intercepts,-slopes))
+    
+    def _intersection(i,j):
+        return (intercepts[j] - intercepts[i]) / (slopes[i] - slopes[j])
+    
+    hull = []
+    for i in order:
+        if hull and slopes[hull[-1]] == slopes[i]:
+            continue # same slope and higher or equal intercept
+        while len(hull) >= 2 and _intersection(hull[-2],i) <= _intersection(hull[-2],hull[-1]):
+            hull.pop()
+        hull.append(i)
+    
+    indexes = np.array(hull,dtype=int)
+    transitions = np.array([_intersection(hull[k],hull[k+1]) for k in range(0,len(hull)-1)])
+    
+    return indexes, transitions
@@ -0,0 +1,594 @@
+# module for solving the charge neutrality condition of defects and charge carriers
+
+
+import numpy as np
+from pymatgen.analysis.defects.utils import kb
+
+
+def get_band_arrays(fdos):
+    """
+    Extract from a FermiDosCarriersInfo object the arrays needed to integrate the carrier concentrations.
+    The weights (tdos * de / volume) are computed only once, so that every evaluation of the
+    carrier concentrations is a single weighted sum over the band states.
+
+    Parameters
+    ----------
+    fdos : (FermiDosCarriersInfo)
+        FermiDosCarriersInfo object of the bulk system.
+
+    Returns
+    -------
+    band_arrays : (dict)
+        Dictionary with energies of the valence and conduction band states relative to the vbm
+        ("vb_energies","cb_energies") and the respective integration weights in cm^-3 ("vb_weights","cb_weights").
+    """
+    _,vbm = fdos.get_cbm_vbm()
+    weights = fdos.tdos * fdos.de / (fdos.volume * fdos.A_to_cm ** 3)
+    band_arrays = {
+        'vb_energies': fdos.energies[:fdos.idx_vbm + 1] - vbm,
+        'vb_weights': weights[:fdos.idx_vbm + 1],
+        'cb_energies': fdos.energies[fdos.idx_cbm:] - vbm,
+        'cb_weights': weights[fdos.idx_cbm:]
+        }
+    return band_arrays
+
+
+def get_carriers_log_charge(band_arrays, fermi_levels, temperatures, cb_shifts=None):
+    """
+    Logarithm of the charge of the intrinsic carriers and its derivative with respect to the Fermi level,
+    for arrays of Fermi levels and temperatures. Positive (holes) and negative (electrons) contributions 
+    are returned separately. The occupations are rescaled by the occupation of the band edge before 
+    the sums over the band states, so that the results are finite also when the carrier 
+    concentrations underflow in linear scale (wide band gaps at low temperature).
+
+    Parameters
+    ----------
+    band_arrays : (dict)
+        Dictionary generated with get_band_arrays().
+    fermi_levels : (ndarray)
+        1D array of Fermi levels relative to the vbm.
+    temperatures : (ndarray)
+        1D array of temperatures in K, same length as fermi_levels.
+    cb_shifts : (ndarray), optional
+        1D array with rigid shifts of the conduction band (change of the band gap) for every condition.
+        The default is None (no shifts).
+
+    Returns
+    -------
+    log_charges : (ndarray)
+        Array (conditions x 2) with log(h) and log(n), with concentrations in cm^-3.
+    dlog_charges : (ndarray)
+        Array (conditions x 2) with the derivatives of log(h) and log(n) with respect to the Fermi level in eV^-1.
+    """
+    kt = kb * np.asarray(temperatures,dtype=float)[:,np.newaxis]
+    fermi_levels = np.asarray(fermi_levels,dtype=float)[:,np.newaxis]
+    # occupation of holes in VB and electrons in CB
+    log_h, dlog_h = _get_log_occupied_states(band_arrays['vb_energies'],band_arrays['vb_weights'],fermi_levels,1/kt)
+    if cb_shifts is not None:
+        fermi_levels = fermi_levels - np.asarray(cb_shifts,dtype=float)[:,np.newaxis]
+    log_n, dlog_n = _get_log_occupied_states(band_arrays['cb_energies'],band_arrays['cb_weights'],fermi_levels,-1/kt)
+
+    return np.stack([log_h,log_n],axis=-1) , np.stack([dlog_h,dlog_n],axis=-1)
+
+
+def get_defects_log_concentrations(charges, intercepts, site_densities, fermi_levels, temperatures,
+                                   entry_names=None, frozen_totals=None):
+    """
+    Logarithm of the defect concentrations and its derivative with respect to the Fermi level.
+    Concentrations are c = N * exp(-(E0 + q*E_F)/kT), so that log(c) is linear in the Fermi level.
+    For frozen defects the total concentration of the specie is fixed and only the distribution
+    of the charge states changes with the Fermi level: c = C_tot * w, with fractions 
+    log(w) = log(c) - log(sum(c)) and derivative of log(c) equal to -(q - <q>)/kT. 
+    Sums over the entries of every specie are computed as segmented log-sum-exp, so that no 
+    threshold is needed for species with concentrations that underflow in linear scale.
+
+    Parameters
+    ----------
+    charges : (ndarray)
+        Charges of the defect entries.
+    intercepts : (ndarray)
+        Array (conditions x entries) of formation energies at Fermi level = 0 (vbm).
+    site_densities : (ndarray)
+        Density of defect sites in cm^-3 (multiplicity * 1e24 / volume of the bulk structure).
+    fermi_levels : (ndarray)
+        1D array of Fermi levels relative to the vbm.
+    temperatures : (ndarray)
+        1D array of temperatures in K, same length as fermi_levels.
+    entry_names : (ndarray)
+        Index of the defect specie (name) of every entry. Needed only for frozen defects.
+    frozen_totals : (ndarray)
+        Array (conditions x names) with the total concentrations of the frozen defect species, 
+        0 for species that are not frozen. The default is None (no frozen defects).
+
+    Returns
+    -------
+    log_concentrations : (ndarray)
+        Array (conditions x entries) with the logarithm of the concentrations in cm^-3.
+    dlog_concentrations : (ndarray)
+        Array (conditions x entries) with the derivatives of log_concentrations in eV^-1.
+    """
+    kt = kb * np.asarray(temperatures,dtype=float)[:,np.newaxis]
+    fermi_levels = np.asarray(fermi_levels,dtype=float)[:,np.newaxis]
+    with np.errstate(divide='ignore'):
+        log_concentrations = np.log(site_densities) - (intercepts + charges * fermi_levels) / kt
+    dlog_concentrations = np.broadcast_to(-1 * charges / kt, log_concentrations.shape)
+
+    if frozen_totals is not None:
+        nnames = frozen_totals.shape[-1]
+        log_fractions = log_concentrations - _segment_logsumexp(log_concentrations,entry_names,nnames)[:,entry_names]
+        q_mean = _segment_sum(charges * np.exp(log_fractions),entry_names,nnames)
+        with np.errstate(divide='ignore'):
+            log_totals = np.log(frozen_totals)
+        frozen = (frozen_totals > 0)[:,entry_names]
+        log_concentrations = np.where(frozen, log_totals[:,entry_names] + log_fractions, log_concentrations)
+        dlog_concentrations = np.where(frozen, -1 * (charges - q_mean[:,entry_names]) / kt, dlog_concentrations)
+
+    return log_concentrations , dlog_concentrations
+
+
+def get_defects_log_charge(charges, intercepts, site_densities, fermi_levels, temperatures,
+                           entry_names=None, frozen_totals=None, external_charges=(0,0)):
+    """
+    Logarithm of the charge of the defects and its derivative with respect to the Fermi level.
+    Positive and negative contributions are returned separately, as log-sum-exp of log(|q|*c) over
+    the entries with positive and negative charge. See get_defects_log_concentrations() for the 
+    treatment of frozen defects.
+
+    Parameters
+    ----------
+    charges : (ndarray)
+        Charges of the defect entries.
+    intercepts : (ndarray)
+        Array (conditions x entries) of formation energies at Fermi level = 0 (vbm).
+    site_densities : (ndarray)
+        Density of defect sites in cm^-3 (multiplicity * 1e24 / volume of the bulk structure).
+    fermi_levels : (ndarray)
+        1D array of Fermi levels relative to the vbm.
+    temperatures : (ndarray)
+        1D array of temperatures in K, same length as fermi_levels.
+    entry_names : (ndarray)
+        Index of the defect specie (name) of every entry. Needed only for frozen defects.
+    frozen_totals : (ndarray)
+        Array (conditions x names) with the total concentrations of the frozen defect species, 
+        0 for species that are not frozen. The default is None (no frozen defects).
+    external_charges : (tuple)
+        Absolute values of the fixed positive and negative charge concentrations of external defects.
+
+    Returns
+    -------
+    log_charges : (ndarray)
+        Array (conditions x 2) with the logarithm of the absolute values of positive and negative 
+        defect charge concentrations in cm^-3.
+    dlog_charges : (ndarray)
+        Array (conditions x 2) with the derivatives of log_charges in eV^-1.
+    """
+    log_concentrations, dlog_concentrations = get_defects_log_concentrations(charges,intercepts,site_densities,fermi_levels,
+                                                                             temperatures,entry_names,frozen_totals)
+    with np.errstate(divide='ignore'):
+        log_q = np.log(np.abs(charges)) + log_concentrations
+        log_external = np.log(np.asarray(external_charges,dtype=float))
+    # external charges are added as terms with derivative 0
+    size = len(log_q)
+    log_charges, dlog_charges = [], []
+    for mask, log_ext in zip((charges > 0, charges < 0),log_external):
+        log_terms = np.concatenate([log_q[:,mask],np.full((size,1),log_ext)],axis=-1)
+        dlog_terms = np.concatenate([dlog_concentrations[:,mask],np.zeros((size,1))],axis=-1)
+        log_sum, dlog_sum = logsumexp(log_terms,dlog_terms)
+        log_charges.append(log_sum)
+        dlog_charges.append(dlog_sum)
+
+    return np.stack(log_charges,axis=-1) , np.stack(dlog_charges,axis=-1)
+
+
+def get_total_log_charge(charges, intercepts, site_densities, band_arrays, fermi_levels, temperatures,
+                         entry_names=None, frozen_totals=None, external_charges=(0,0), cb_shifts=None):
+    """
+    Logarithm of the total positive and negative charge (defects and carriers) and its derivative 
+    with respect to the Fermi level. See get_defects_log_charge() and get_carriers_log_charge()
+    for the description of the arguments.
+
+    Returns
+    -------
+    log_charges : (ndarray)
+        Array (conditions x 2) with the logarithm of the absolute values of positive and negative 
+        charge concentrations in cm^-3.
+    dlog_charges : (ndarray)
+        Array (conditions x 2) with the derivatives of log_charges in eV^-1.
+    """
+    log_defects, dlog_defects = get_defects_log_charge(charges,intercepts,site_densities,fermi_levels,temperatures,
+                                                       entry_names,frozen_totals,external_charges)
+    log_carriers, dlog_carriers = get_carriers_log_charge(band_arrays,fermi_levels,temperatures,cb_shifts)
+    return logsumexp(np.stack([log_defects,log_carriers],axis=-1),np.stack([dlog_defects,dlog_carriers],axis=-1))
+
+
+def get_carriers_charge_array(band_arrays, fermi_levels, temperatures, cb_shifts=None):
+    """
+    Same as get_carriers_log_charge() in linear scale.
+
+    Returns
+    -------
+    charges : (ndarray)
+        Array (conditions x 2) with absolute values of positive and negative charge concentrations (h,n) in cm^-3.
+    derivatives : (ndarray)
+        Array (conditions x 2) with the derivatives of h and n with respect to the Fermi level in cm^-3/eV.
+    """
+    log_charges, dlog_charges = get_carriers_log_charge(band_arrays,fermi_levels,temperatures,cb_shifts)
+    charges = np.exp(log_charges)
+    return charges , charges * dlog_charges
+
+
+def get_defects_charge_array(charges, intercepts, site_densities, fermi_levels, temperatures,
+                             entry_names=None, frozen_totals=None, external_charges=(0,0)):
+    """
+    Same as get_defects_log_charge() in linear scale.
+
+    Returns
+    -------
+    charges : (ndarray)
+        Array (conditions x 2) with absolute values of positive and negative defect charge concentrations in cm^-3.
+    derivatives : (ndarray)
+        Array (conditions x 2) with the derivatives of the positive and negative charge concentrations in cm^-3/eV.
+    """
+    log_charges, dlog_charges = get_defects_log_charge(charges,intercepts,site_densities,fermi_levels,temperatures,
+                                                       entry_names,frozen_totals,external_charges)
+    q = np.exp(log_charges)
+    return q , q * dlog_charges
+
+
+def logsumexp(log_values, dlog_values):
+    """
+    Logarithm of the sum of exp(log_values) on the last axis and its derivative, given the derivatives
+    of the logarithms of the single terms (the derivative of the log of the sum is the average of 
+    the derivatives weighted with the terms). Terms are rescaled by their maximum, so that the 
+    result is finite also if all terms underflow in linear scale. Terms equal to -inf are ignored.
+
+    Parameters
+    ----------
+    log_values : (ndarray)
+        Logarithms of the terms of the sum.
+    dlog_values : (ndarray)
+        Derivatives of the logarithms of the terms, same shape of log_values.
+
+    Returns
+    -------
+    log_sum : (ndarray)
+        Logarithm of the sum, -inf if all terms are 0.
+    dlog_sum : (ndarray)
+        Derivative of the logarithm of the sum, 0 if all terms are 0.
+    """
+    shift = np.max(log_values,axis=-1,keepdims=True)
+    shift = np.where(np.isfinite(shift),shift,0)
+    terms = np.exp(log_values - shift)
+    total = terms.sum(axis=-1)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        log_sum = np.log(total) + shift[...,0]
+        dlog_sum = np.where(terms > 0, terms * dlog_values, 0).sum(axis=-1) / total
+    return log_sum , np.where(total > 0, dlog_sum, 0)
+
+
+def _get_log_occupied_states(energies, weights, fermi_levels, beta):
+    """
+    Logarithm of sum(weights * f) over the band states and its derivative with respect to the Fermi level, 
+    with f = 1/(1+exp(-x)) the occupation of holes (beta = 1/kT) or electrons (beta = -1/kT) and 
+    x = beta*(energies - fermi_levels). Occupations are multiplied by exp(-s), with s = min(x_edge,0) 
+    the (approximate) logarithm of the occupation of the band edge (state with non-zero weight 
+    closest to the gap), and computed as 1/(exp(s) + exp(s-x)), which does not underflow.
+    """
+    edge = energies[weights > 0].max() if beta[0,0] > 0 else energies[weights > 0].min()
+    shift = np.minimum(beta * (edge - fermi_levels),0)
+    occupations = beta * (fermi_levels - energies)
+    occupations += shift
+    with np.errstate(over='ignore'):
+        np.exp(occupations,out=occupations)
+    occupations += np.exp(shift)
+    np.reciprocal(occupations,out=occupations)
+    total = np.dot(occupations,weights)
+    # derivative of f is -beta*f*(1-f)
+    derivatives = 1 - occupations * np.exp(shift)
+    derivatives *= occupations
+    dtotal = -1 * beta[:,0] * np.dot(derivatives,weights)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        log_total = np.log(total) + shift[:,0]
+        dlog_total = dtotal / total
+    return log_total , np.where(total > 0, dlog_total, 0)
+
+
+def _get_segments(entry_names):
+    """
+    Order that sorts the entries by name, start of every segment of entries with the same name 
+    in the sorted entries and index of the name of every segment.
+    """
+    order = np.argsort(entry_names,kind='stable')
+    sorted_names = entry_names[order]
+    starts = np.flatnonzero(np.r_[True,sorted_names[1:] != sorted_names[:-1]])
+    return order, starts, sorted_names[starts]
+
+
+def _segment_sum(values, entry_names, nnames):
+    """
+    Sum over the entries of every name on the last axis of values (conditions x entries).
+    Returns an array (conditions x names).
+    """
+    order, starts, segment_names = _get_segments(entry_names)
+    sums = np.zeros(values.shape[:-1] + (nnames,))
+    sums[...,segment_names] = np.add.reduceat(values[...,order],starts,axis=-1)
+    return sums
+
+
+def _segment_logsumexp(log_values, entry_names, nnames):
+    """
+    Log-sum-exp over the entries of every name on the last axis of log_values (conditions x entries), 
+    every segment is rescaled by its own maximum. Returns an array (conditions x names).
+    """
+    order, starts, segment_names = _get_segments(entry_names)
+    shift = np.full(log_values.shape[:-1] + (nnames,),-np.inf)
+    shift[...,segment_names] = np.maximum.reduceat(log_values[...,order],starts,axis=-1)
+    shift = np.where(np.isfinite(shift),shift,0)
+    with np.errstate(divide='ignore'):
+        return np.log(_segment_sum(np.exp(log_values - shift[...,entry_names]),entry_names,nnames)) + shift
+
+
+def solve_neutrality(total_log_charge, emin, emax, xtol=1e-12, maxiter=100):
+    """
+    Find the Fermi level at which positive and negative charges are equal with a safeguarded 
+    Newton method. Since the charges vary exponentially with the Fermi level, Newton steps are 
+    taken on log(positive) - log(negative), which is a smooth and almost linear function of the Fermi level.
+    Charges are evaluated directly in log scale, so the function is finite in the whole interval.
+    The root is kept bracketed: a Newton step is taken only when it falls inside the bracket
+    and reduces the step by at least a factor of 2, otherwise bisection is used.
+    Convergence is therefore never slower than bisection.
+
+    Parameters
+    ----------
+    total_log_charge : (function)
+        Function of the Fermi level that returns the logarithms of the absolute values of the positive 
+        and negative charges and their derivatives ([log_positive,log_negative],[dlog_positive,dlog_negative]).
+    emin : (float)
+        Lower bound of the Fermi level.
+    emax : (float)
+        Upper bound of the Fermi level.
+    xtol : (float), optional
+        Absolute tolerance on the Fermi level. The default is 1e-12.
+    maxiter : (int), optional
+        Maximum number of iterations. The default is 100.
+
+    Returns
+    -------
+    fermi_level : (float)
+        Fermi level dictated by charge neutrality.
+    stats : (dict)
+        Dictionary with number of iterations ("iterations"), number of evaluations of the total charge
+        ("function_calls"), number of Newton steps ("newton_steps") and residual charge ("residual").
+    """
+    def _log_ratio(fermi_level):
+        (log_positive, log_negative), (dlog_positive, dlog_negative) = total_log_charge(fermi_level)
+        with np.errstate(invalid='ignore'):
+            f = log_positive - log_negative
+        return f, dlog_positive - dlog_negative, np.exp(log_positive) - np.exp(log_negative)
+
+    f_min, _, q_min = _log_ratio(emin)
+    f_max, _, q_max = _log_ratio(emax)
+    stats = {'iterations':0, 'function_calls':2, 'newton_steps':0, 'residual':None}
+    if f_min == 0:
+        stats['residual'] = q_min
+        return emin , stats
+    if f_max == 0:
+        stats['residual'] = q_max
+        return emax , stats
+    if not (f_min > 0 and f_max < 0):
+        raise ValueError('Total charge must be positive at the lower bound and negative at the upper bound of the Fermi level interval')
+
+    low, high = emin, emax
+    fermi_level = 0.5 * (low + high)
+    dx_old = abs(high - low)
+    dx = dx_old
+    f, df, q = _log_ratio(fermi_level)
+    stats['function_calls'] += 1
+
+    for i in range(1,maxiter+1):
+        stats['iterations'] = i
+        newton_step = (np.isfinite(f) and np.isfinite(df) and df != 0 and low <= fermi_level - f/df <= high 
+                       and abs(2*f) < abs(dx_old*df))
+        dx_old = dx
+        if newton_step:
+            dx = f/df
+            fermi_level = fermi_level - dx
+            stats['newton_steps'] += 1
+        else:
+            dx = 0.5 * (high - low)
+            fermi_level = low + dx
+
+        f, df, q = _log_ratio(fermi_level)
+        stats['function_calls'] += 1
+        stats['residual'] = q
+        if abs(dx) < xtol or f == 0:
+            return fermi_level , stats
+
+        if f > 0:
+            low = fermi_level
+        else:
+            high = fermi_level
+
+    raise RuntimeError(f'Charge neutrality failed to converge after {maxiter} iterations, value is {fermi_level}')
+
+
+def solve_neutrality_array(total_log_charge, emin, emax, size, xtol=1e-12, maxiter=100):
+    """
+    Vectorized version of solve_neutrality(): the charge neutrality conditions are solved 
+    together, every condition with its own bracket and safeguarded Newton/bisection step.
+    Only the conditions that are not converged yet are evaluated at every iteration.
+
+    Parameters
+    ----------
+    total_log_charge : (function)
+        Function with arguments (fermi_levels,indexes) that returns the logarithms of the absolute values 
+        of the positive and negative charges and their derivatives as arrays (len(indexes) x 2) for the 
+        conditions selected by indexes.
+    emin : (float or ndarray)
+        Lower bound of the Fermi level.
+    emax : (float or ndarray)
+        Upper bound of the Fermi level.
+    size : (int)
+        Number of conditions.
+    xtol : (float), optional
+        Absolute tolerance on the Fermi level. The default is 1e-12.
+    maxiter : (int), optional
+        Maximum number of iterations. The default is 100.
+
+    Returns
+    -------
+    fermi_levels : (ndarray)
+        Fermi levels dictated by charge neutrality.
+    iterations : (ndarray)
+        Number of iterations needed for every condition.
+    """
+    def _log_ratio(fermi_levels,indexes):
+        log_charges, dlog_charges = total_log_charge(fermi_levels,indexes)
+        with np.errstate(invalid='ignore'):
+            f = log_charges[:,0] - log_charges[:,1]
+        return f, dlog_charges[:,0] - dlog_charges[:,1]
+
+    all_indexes = np.arange(size)
+    low = np.broadcast_to(np.asarray(emin,dtype=float),(size,)).copy()
+    high = np.broadcast_to(np.asarray(emax,dtype=float),(size,)).copy()
+    f_low, _ = _log_ratio(low,all_indexes)
+    f_high, _ = _log_ratio(high,all_indexes)
+    if not (np.all(f_low > 0) and np.all(f_high < 0)):
+        raise ValueError('Total charge must be positive at the lower bound and negative at the upper bound of the Fermi level interval')
+
+    fermi_levels = 0.5 * (low + high)
+    dx_old = abs(high - low)
+    dx = dx_old.copy()
+    f, df = _log_ratio(fermi_levels,all_indexes)
+    iterations = np.zeros(size,dtype=int)
+    converged = np.zeros(size,dtype=bool)
+
+    for i in range(0,maxiter):
+        a = np.flatnonzero(~converged)
+        if len(a) == 0:
+            break
+        iterations[a] += 1
+        with np.errstate(divide='ignore',invalid='ignore'):
+            target = fermi_levels[a] - f[a]/df[a]
+            newton_step = (np.isfinite(target) & (df[a] != 0) & (low[a] <= target) & (target <= high[a])
+                           & (abs(2*f[a]) < abs(dx_old[a]*df[a])))
+        dx_old[a] = dx[a]
+        dx[a] = np.where(newton_step, f[a]/np.where(newton_step,df[a],1), 0.5*(high[a] - low[a]))
+        fermi_levels[a] = np.where(newton_step, fermi_levels[a] - dx[a], low[a] + dx[a])
+
+        f[a], df[a] = _log_ratio(fermi_levels[a],a)
+        converged[a] = (abs(dx[a]) < xtol) | (f[a] == 0)
+        positive = f[a] > 0
+        low[a] = np.where(positive, fermi_levels[a], low[a])
+        high[a] = np.where(positive, high[a], fermi_levels[a])
+
+    if not np.all(converged):
+        raise RuntimeError(f'Charge neutrality failed to converge after {maxiter} iterations for {np.sum(~converged)} conditions')
+
+    return fermi_levels , iterations
+
+
+def solve_equilibrium_conditions(charges, intercepts, site_densities, temperatures, band_arrays, emin, emax, xtol=1e-12,
+                                 cb_shifts=None):
+    """
+    Solve the charge neutrality in equilibrium for a set of conditions (chemical potentials and temperatures)
+    and compute the resulting carrier and defect concentrations.
+
+    Parameters
+    ----------
+    charges : (ndarray)
+        Charges of the defect entries.
+    intercepts : (ndarray)
+        Array (conditions x entries) of formation energies at Fermi level = 0 (vbm).
+    site_densities : (ndarray)
+        Density of defect sites in cm^-3 (multiplicity * 1e24 / volume of the bulk structure).
+    temperatures : (ndarray)
+        1D array of temperatures in K, one for every condition.
+    band_arrays : (dict)
+        Dictionary generated with get_band_arrays().
+    emin : (float)
+        Lower bound of the Fermi level.
+    emax : (float)
+        Upper bound of the Fermi level.
+    xtol : (float), optional
+        Absolute tolerance on the Fermi level. The default is 1e-12.
+    cb_shifts : (ndarray), optional
+        1D array with rigid shifts of the conduction band for every condition. The default is None.
+
+    Returns
+    -------
+    fermi_levels : (ndarray)
+        Fermi levels relative to the vbm.
+    carriers : (ndarray)
+        Array (conditions x 2) with hole and electron concentrations in cm^-3.
+    concentrations : (ndarray)
+        Array (conditions x entries) with defect concentrations in cm^-3.
+    iterations : (ndarray)
+        Number of iterations needed for every condition.
+    """
+    def _get_total_log_q(ef,indexes):
+        return get_total_log_charge(charges,intercepts[indexes],site_densities,band_arrays,ef,temperatures[indexes],
+                                    cb_shifts=cb_shifts[indexes] if cb_shifts is not None else None)
+
+    fermi_levels, iterations = solve_neutrality_array(_get_total_log_q,emin,emax,len(temperatures),xtol=xtol)
+    carriers = get_carriers_charge_array(band_arrays,fermi_levels,temperatures,cb_shifts)[0]
+    concentrations = np.exp(get_defects_log_concentrations(charges,intercepts,site_densities,fermi_levels,temperatures)[0])
+
+    return fermi_levels, carriers, concentrations, iterations
+
+
+def solve_non_equilibrium_conditions(charges, intercepts, site_densities, temperatures, band_arrays, emin, emax,
+                                     entry_names, frozen_totals, external_charges=(0,0), xtol=1e-12):
+    """
+    Solve the charge neutrality with frozen defect species (fixed total concentrations) for a set 
+    of conditions and compute the resulting carrier and defect concentrations. 
+    See DefectsAnalysis.non_equilibrium_fermi_level() for the description of the groups of defects.
+
+    Parameters
+    ----------
+    charges : (ndarray)
+        Charges of the defect entries.
+    intercepts : (ndarray)
+        Array (conditions x entries) of formation energies at Fermi level = 0 (vbm).
+    site_densities : (ndarray)
+        Density of defect sites in cm^-3 (multiplicity * 1e24 / volume of the bulk structure).
+    temperatures : (ndarray)
+        1D array of temperatures in K, one for every condition.
+    band_arrays : (dict)
+        Dictionary generated with get_band_arrays().
+    emin : (float)
+        Lower bound of the Fermi level.
+    emax : (float)
+        Upper bound of the Fermi level.
+    entry_names : (ndarray)
+        Index of the defect specie (name) of every entry.
+    frozen_totals : (ndarray)
+        Array (conditions x names) with the total concentrations of the frozen defect species, 
+        0 for species that are not frozen.
+    external_charges : (tuple)
+        Absolute values of the fixed positive and negative charge concentrations of external defects.
+    xtol : (float), optional
+        Absolute tolerance on the Fermi level. The default is 1e-12.
+
+    Returns
+    -------
+    fermi_levels : (ndarray)
+        Fermi levels relative to the vbm.
+    carriers : (ndarray)
+        Array (conditions x 2) with hole and electron concentrations in cm^-3.
+    concentrations : (ndarray)
+        Array (conditions x entries) with defect concentrations in cm^-3. Concentrations of frozen 
+        species are normalized to the frozen totals.
+    iterations : (ndarray)
+        Number of iterations needed for every condition.
+    """
+    def _get_total_log_q(ef,indexes):
+        return get_total_log_charge(charges,intercepts[indexes],site_densities,band_arrays,ef,temperatures[indexes],
+                                    entry_names,frozen_totals[indexes],external_charges)
+
+    fermi_levels, iterations = solve_neutrality_array(_get_total_log_q,emin,emax,len(temperatures),xtol=xtol)
+    carriers = get_carriers_charge_array(band_arrays,fermi_levels,temperatures)[0]
+    concentrations = np.exp(get_defects_log_concentrations(charges,intercepts,site_densities,fermi_levels,temperatures,
+                                                           entry_names,frozen_totals)[0])
+
+    return fermi_levels, carriers, concentrations, iterations
@@ -0,0 +1,174 @@
+# module for running defect thermodynamics sweeps on a pool of processes
+
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from pynter.defects.neutrality import solve_equilibrium_conditions, solve_non_equilibrium_conditions
+
+
+class SharedArrays:
+
+    def __init__(self, arrays):
+        """
+        Copy a dictionary of NumPy arrays in shared memory blocks, such that worker processes can
+        access them without pickling. Can be used as a context manager, the blocks are released on exit.
+
+        Parameters
+        ----------
+        arrays : (dict)
+            Dictionary with names as keys and arrays as values.
+        """
+        self._blocks = {}
+        self.arrays = {}
+        for key,array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True,size=max(array.nbytes,1))
+            view = np.ndarray(array.shape,dtype=array.dtype,buffer=block.buf)
+            view[...] = array
+            self._blocks[key] = block
+            self.arrays[key] = view
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getitem__(self,key):
+        return self.arrays[key]
+
+    @property
+    def spec(self):
+        """
+        Picklable description of the shared arrays ({key:(block name,shape,dtype)}),
+        used by attach_shared_arrays() to access the arrays from another process.
+        """
+        return {key:(self._blocks[key].name,self.arrays[key].shape,self.arrays[key].dtype.str) for key in self.arrays}
+
+    def close(self):
+        """
+        Release the shared memory blocks. Arrays need to be copied before if they are still needed.
+        """
+        self.arrays = {}
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks = {}
+
+
+def attach_shared_arrays(spec):
+    """
+    Access arrays created with SharedArrays from another process.
+
+    Parameters
+    ----------
+    spec : (dict)
+        Description of the shared arrays, generated with SharedArrays.spec.
+
+    Returns
+    -------
+    arrays : (dict)
+        Dictionary with NumPy arrays using the shared memory blocks as buffers.
+    blocks : (list)
+        List of SharedMemory objects, references need to be kept as long as the arrays are used.
+    """
+    arrays = {}
+    blocks = []
+    for key,(name,shape,dtype) in spec.items():
+        # the creating process is in charge of unlinking the block
+        block = shared_memory.SharedMemory(name=name)
+        arrays[key] = np.ndarray(shape,dtype=np.dtype(dtype),buffer=block.buf)
+        blocks.append(block)
+    return arrays, blocks
+
+
+_worker_arrays = {}
+_worker_blocks = []
+
+def _init_worker(spec):
+    """
+    Initializer of the worker processes, attaches the shared arrays once per process.
+    """
+    global _worker_arrays, _worker_blocks
+    _worker_arrays, _worker_blocks = attach_shared_arrays(spec)
+
+
+def _solve_chunk(start, stop, settings):
+    """
+    Solve the charge neutrality for the conditions with flat indexes in [start,stop) and write
+    the results in the shared output arrays. Conditions are ordered as (temperatures,chempots).
+    If "frozen_totals" is present in the shared arrays the total concentrations of the defect
+    species are fixed (see DefectsAnalysis.non_equilibrium_fermi_level).
+    """
+    a = _worker_arrays
+    nchem = len(a['intercepts'])
+    conditions = np.arange(start,stop)
+    temperatures = a['temperatures'][conditions // nchem]
+    chempot_indexes = conditions % nchem
+    band_arrays = {key:a[key] for key in ('vb_energies','vb_weights','cb_energies','cb_weights')}
+
+    if 'frozen_totals' not in a:
+        cb_shifts = a['cb_shifts'][chempot_indexes] if 'cb_shifts' in a else None
+        results = solve_equilibrium_conditions(a['charges'],a['intercepts'][chempot_indexes],a['site_densities'],temperatures,
+                                               band_arrays,settings['emin'],settings['emax'],xtol=settings['xtol'],
+                                               cb_shifts=cb_shifts)
+    else:
+        results = solve_non_equilibrium_conditions(a['charges'],a['intercepts'][chempot_indexes],a['site_densities'],temperatures,
+                                                   band_arrays,settings['emin'],settings['emax'],a['entry_names'],
+                                                   a['frozen_totals'][chempot_indexes],settings['external_charges'],
+                                                   xtol=settings['xtol'])
+    a['fermi_levels'][start:stop], a['carriers'][start:stop], a['concentrations'][start:stop], a['iterations'][start:stop] = results
+
+    return start, stop
+
+
+def run_sharded(arrays, size, settings, chunk_size=100, processes=None, progress=None):
+    """
+    Solve the charge neutrality for a set of conditions on a pool of processes. Input arrays are
+    shipped once to the workers through shared memory and every worker writes its results directly
+    in shared output arrays, so that the order of the results does not depend on the order of completion.
+
+    Parameters
+    ----------
+    arrays : (dict)
+        Input arrays: "charges", "site_densities", "intercepts" (chempots x entries), "temperatures",
+        band arrays (see neutrality.get_band_arrays()) and optionally "frozen_totals" (chempots x names)
+        with "entry_names" (index of the name of every entry) or "cb_shifts" (shift of the conduction 
+        band for every set of chempots, only in equilibrium).
+    size : (int)
+        Number of conditions (temperatures x chempots).
+    settings : (dict)
+        Settings of the solver: "emin", "emax", "xtol" and "external_charges" (positive and negative
+        charge of external defects).
+    chunk_size : (int), optional
+        Number of conditions in every task. The default is 100.
+    processes : (int), optional
+        Number of worker processes. The default is None (number of CPUs).
+    progress : (function), optional
+        Function called with arguments (completed tasks, total tasks) every time a task is completed.
+
+    Returns
+    -------
+    results : (dict)
+        Dictionary with arrays "fermi_levels", "carriers" (conditions x 2), "concentrations"
+        (conditions x entries) and "iterations".
+    """
+    outputs = {
+        'fermi_levels':np.zeros(size),
+        'carriers':np.zeros((size,2)),
+        'concentrations':np.zeros((size,len(arrays['charges']))),
+        'iterations':np.zeros(size,dtype=int)
+        }
+    with SharedArrays({**arrays,**outputs}) as shared:
+        chunks = [(start,min(start+chunk_size,size)) for start in range(0,size,chunk_size)]
+        with ProcessPoolExecutor(max_workers=processes,initializer=_init_worker,initargs=(shared.spec,)) as executor:
+            futures = [executor.submit(_solve_chunk,start,stop,settings) for start,stop in chunks]
+            for completed,future in enumerate(as_completed(futures),start=1):
+                future.result()
+                if progress:
+                    progress(completed,len(chunks))
+
+        results = {key:np.array(shared[key]) for key in outputs}
+
+    return results
@@ -9,6 +9,8 @@ This module defines classes to represent the density of states, etc.
 import numpy as np
 import warnings
 import functools
+import hashlib
+from collections import OrderedDict
 from monty.json import MSONable
 from pymatgen.electronic_structure.core import Spin, Orbital
 from pymatgen.core.periodic_table import get_el_sp
@@ -16,6 +18,7 @@ from pymatgen.core.structure import Structure
 from pymatgen.core.spectrum import Spectrum
 from pymatgen.util.coord import get_linear_interpolated_value
 from scipy.constants.codata import value as _cd
+from pynter.defects.neutrality import get_band_arrays, get_carriers_log_charge, solve_neutrality
 
 __author__ = "Shyue Ping Ong"
 __copyright__ = "Copyright 2012, The Materials Project"
@@ -424,7 +427,8 @@ class FermiDosCarriersInfo(Dos, MSONable):
     """
 
     def __init__(self, dos: Dos, structure: Structure = None,
-                 nelecs: float = None, bandgap: float = None):
+                 nelecs: float = None, bandgap: float = None,
+                 boltzmann_rtol: float = None, trim_kt: float = None):
         """
         Args:
             dos: Pymatgen Dos object.
@@ -436,6 +440,14 @@ class FermiDosCarriersInfo(Dos, MSONable):
                 number of electrons in the structure.
             bandgap: If set, the energy values are scissored so that the electronic
                 band gap matches this value.
+            boltzmann_rtol: If set, the carrier concentrations are computed in the
+                Boltzmann approximation from precomputed moments of the band edges
+                when the relative error is guaranteed to be below this value, and
+                with the exact Fermi-Dirac integral otherwise (see get_doping).
+            trim_kt: If set, only the states within trim_kt*kT from the band edges
+                are integrated with the Fermi-Dirac distribution, the remaining states
+                are included as precomputed Boltzmann tails (see get_doping and 
+                get_truncation_error).
         """
         super().__init__(dos.efermi, energies=dos.energies,
                          densities={k: np.array(d) for k, d in
@@ -481,36 +493,235 @@ class FermiDosCarriersInfo(Dos, MSONable):
             self.energies[:idx_fermi] -= (bandgap - (ecbm - evbm)) / 2.0
             self.energies[idx_fermi:] += (bandgap - (ecbm - evbm)) / 2.0
 
-    def get_doping(self, fermi_level,temperature,carriers_values=False):
+        self.boltzmann_rtol = boltzmann_rtol
+        self.trim_kt = trim_kt
+        self._boltzmann_moments = {}
+        self._band_windows = {}
+        self._band_arrays = None
+
+    def get_doping(self, fermi_level, temperature, carriers_values=False,
+                   chunk_size=None):
         """
         Calculate the doping (majority carrier concentration) at a given
         fermi level  and temperature. A simple Left Riemann sum is used for
         integrating the density of states over energy & equilibrium Fermi-Dirac
-        distribution.
+        distribution. Fermi levels and temperatures can be arrays, broadcasted 
+        against each other, in which case the integrals for all points are computed 
+        as a single product of the weights of the states with the matrix of the 
+        occupations (states x points), split in chunks of points to bound the memory.
+
+        If boltzmann_rtol is set and the Fermi level is at least -kT*ln(boltzmann_rtol)
+        away from a band edge, the integral of that band is computed in O(1) as
+        exp(-|E_edge - fermi_level|/kT) times the Boltzmann moment of the band 
+        (see get_boltzmann_moments). Since every state is farther from the Fermi 
+        level than the band edge, the relative error of the approximation is at most 
+        exp(-|E_edge - fermi_level|/kT) <= boltzmann_rtol (the concentration is overestimated).
+        Closer to degeneracy the exact integral is used.
+
+        If trim_kt is set and the Fermi level is on the band gap side of a band edge, the 
+        Fermi-Dirac integral of that band runs only over the states within trim_kt*kT from 
+        the edge, and the states beyond are included with their Boltzmann moment 
+        (see get_band_window). The relative truncation error is at most exp(-trim_kt), 
+        the absolute bound is given by get_truncation_error. Otherwise the whole band is integrated.
 
         Args:
-            fermi_level: The fermi_level level in eV.
-            temperature: The temperature in Kelvin.
+            fermi_level: The fermi_level level in eV (float or array).
+            temperature: The temperature in Kelvin (float or array).
+            carriers_values: Return h and n separately instead of the doping.
+            chunk_size: Number of points integrated at once. Default is such that
+                the matrix of the occupations has about 1e6 elements.
 
         Returns:
-            The doping concentration in units of 1/cm^3. First output is positive 
-            intrinsic carrier concentration (h), second is negative intrinsic carrier concentration (n).
-        """
-        cb_integral = np.sum(
-            self.tdos[self.idx_cbm:]
-            * f0(self.energies[self.idx_cbm:], fermi_level, temperature)
-            * self.de[self.idx_cbm:], axis=0)
-        vb_integral = np.sum(
-            self.tdos[:self.idx_vbm + 1] *
-            f0_holes(self.energies[:self.idx_vbm + 1], fermi_level, temperature)
-            * self.de[:self.idx_vbm + 1], axis=0)
-        h = (vb_integral) / (self.volume * self.A_to_cm ** 3) 
-        n = -1*(cb_integral) / (self.volume * self.A_to_cm ** 3)
+            The doping concentration in units of 1/cm^3, with the broadcasted shape of 
+            fermi_level and temperature. If carriers_values is True the first output is 
+            positive intrinsic carrier concentration (h), second is negative intrinsic 
+            carrier concentration (n).
+        """
+        fermi_levels, temperatures = np.broadcast_arrays(
+            np.asarray(fermi_level, dtype=float), np.asarray(temperature, dtype=float))
+        shape = fermi_levels.shape
+        fermi_levels, temperatures = fermi_levels.ravel(), temperatures.ravel()
+        vb_exact = np.ones(fermi_levels.size, dtype=bool)
+        cb_exact = np.ones(fermi_levels.size, dtype=bool)
+        vb_integral = np.zeros(fermi_levels.size)
+        cb_integral = np.zeros(fermi_levels.size)
+
+        if self.boltzmann_rtol:
+            kT = _cd("Boltzmann constant in eV/K") * temperatures
+            vb_exponents = (self.energies[self.idx_vbm] - fermi_levels) / kT
+            cb_exponents = (fermi_levels - self.energies[self.idx_cbm]) / kT
+            vb_exact = vb_exponents > np.log(self.boltzmann_rtol)
+            cb_exact = cb_exponents > np.log(self.boltzmann_rtol)
+            unique_temperatures, inverse = np.unique(temperatures, return_inverse=True)
+            moments = np.array([self.get_boltzmann_moments(T) for T in unique_temperatures])[inverse]
+            vb_integral[~vb_exact] = moments[~vb_exact, 0] * np.exp(vb_exponents[~vb_exact])
+            cb_integral[~cb_exact] = moments[~cb_exact, 1] * np.exp(cb_exponents[~cb_exact])
+
+        if self.trim_kt:
+            vb_integral[vb_exact] = self._get_trimmed_band_integral(
+                "vb", fermi_levels[vb_exact], temperatures[vb_exact], chunk_size)
+            cb_integral[cb_exact] = self._get_trimmed_band_integral(
+                "cb", fermi_levels[cb_exact], temperatures[cb_exact], chunk_size)
+        else:
+            vb_integral[vb_exact] = self._get_band_integral(
+                slice(None, self.idx_vbm + 1), f0_holes, fermi_levels[vb_exact],
+                temperatures[vb_exact], chunk_size)
+            cb_integral[cb_exact] = self._get_band_integral(
+                slice(self.idx_cbm, None), f0, fermi_levels[cb_exact],
+                temperatures[cb_exact], chunk_size)
+
+        h = (vb_integral.reshape(shape)) / (self.volume * self.A_to_cm ** 3) 
+        n = -1*(cb_integral.reshape(shape)) / (self.volume * self.A_to_cm ** 3)
+        if shape == ():
+            h, n = h[()], n[()]
         if carriers_values:
             return h , n
         else:
             return h + n
 
+    def _get_band_integral(self, states, distribution, fermi_levels, temperatures,
+                           chunk_size=None):
+        """
+        Integral of tdos * distribution over the states selected by the slice "states"
+        for 1D arrays of Fermi levels and temperatures, computed in chunks of points.
+        """
+        weights = self.tdos[states] * self.de[states]
+        energies = self.energies[states]
+        if not chunk_size:
+            chunk_size = max(1, int(1e6) // len(energies))
+        integrals = np.zeros(len(fermi_levels))
+        for start in range(0, len(fermi_levels), chunk_size):
+            stop = start + chunk_size
+            occupations = distribution(energies[:, np.newaxis], fermi_levels[start:stop],
+                                       temperatures[start:stop])
+            integrals[start:stop] = weights @ occupations
+        return integrals
+
+    def _get_trimmed_band_integral(self, band, fermi_levels, temperatures, chunk_size=None):
+        """
+        Integral of the valence ("vb") or conduction ("cb") band in trimmed mode for 1D arrays 
+        of Fermi levels and temperatures: Fermi-Dirac integral over the window of the band plus 
+        Boltzmann tail, or over the whole band when the Fermi level is inside the band.
+        """
+        if band == "vb":
+            states, distribution = slice(None, self.idx_vbm + 1), f0_holes
+        else:
+            states, distribution = slice(self.idx_cbm, None), f0
+        exponents = self._get_edge_exponents(band, fermi_levels, temperatures)
+        integrals = np.zeros(len(fermi_levels))
+        unique_temperatures, inverse = np.unique(temperatures, return_inverse=True)
+        for i, T in enumerate(unique_temperatures):
+            window, tail_moment, _ = self.get_band_window(band, T)
+            trimmed = (inverse == i) & (exponents <= 0)
+            integrals[trimmed] = self._get_band_integral(
+                window, distribution, fermi_levels[trimmed], temperatures[trimmed],
+                chunk_size) + tail_moment * np.exp(exponents[trimmed])
+        full = exponents > 0
+        integrals[full] = self._get_band_integral(
+            states, distribution, fermi_levels[full], temperatures[full], chunk_size)
+        return integrals
+
+    def _get_edge_exponents(self, band, fermi_levels, temperatures):
+        """
+        -|E_edge - fermi_level|/kT for the valence ("vb") or conduction ("cb") band, 
+        with positive sign if the Fermi level is inside the band.
+        """
+        kT = _cd("Boltzmann constant in eV/K") * temperatures
+        if band == "vb":
+            return (self.energies[self.idx_vbm] - fermi_levels) / kT
+        return (fermi_levels - self.energies[self.idx_cbm]) / kT
+
+    def get_band_window(self, band, temperature):
+        """
+        States of the valence ("vb") or conduction ("cb") band within trim_kt*kT from the 
+        band edge, and Boltzmann moment of the remaining states (tail), 
+        sum(tdos * de * exp(-|E - E_edge|/kT)). The windows are computed once per temperature.
+
+        Args:
+            band: "vb" or "cb".
+            temperature: The temperature in Kelvin.
+
+        Returns:
+            Slice of the states in the window, moment of the tail (states per cell) and 
+            distance of the first state of the tail from the band edge in units of kT 
+            (inf if the tail is empty).
+        """
+        if (band, temperature) not in self._band_windows:
+            kT = _cd("Boltzmann constant in eV/K") * temperature
+            if band == "vb":
+                edge = self.energies[self.idx_vbm]
+                start = np.searchsorted(self.energies[:self.idx_vbm + 1],
+                                        edge - self.trim_kt * kT, side="left")
+                window, tail = slice(start, self.idx_vbm + 1), slice(None, start)
+                cut = (edge - self.energies[start - 1]) / kT if start > 0 else np.inf
+            else:
+                edge = self.energies[self.idx_cbm]
+                stop = self.idx_cbm + np.searchsorted(self.energies[self.idx_cbm:],
+                                                      edge + self.trim_kt * kT, side="right")
+                window, tail = slice(self.idx_cbm, stop), slice(stop, None)
+                cut = (self.energies[stop] - edge) / kT if stop < len(self.energies) else np.inf
+            tail_moment = np.sum(self.tdos[tail] * self.de[tail]
+                                 * np.exp(-abs(self.energies[tail] - edge) / kT))
+            self._band_windows[(band, temperature)] = (window, tail_moment, cut)
+        return self._band_windows[(band, temperature)]
+
+    def get_truncation_error(self, fermi_level, temperature):
+        """
+        Upper bound of the truncation error of the carrier concentrations computed in 
+        trimmed mode (see get_doping). The Boltzmann tail overestimates the occupation of 
+        every state of the tail at most by a factor exp(-|E - fermi_level|/kT) relative, 
+        therefore the error is bounded by tail * exp(-|E_cut - fermi_level|/kT), with E_cut 
+        the first state of the tail. It is 0 when the whole band is integrated.
+
+        Args:
+            fermi_level: The fermi_level level in eV (float or array).
+            temperature: The temperature in Kelvin (float or array).
+
+        Returns:
+            Absolute errors of h and n in units of 1/cm^3, with the broadcasted shape of 
+            fermi_level and temperature.
+        """
+        fermi_levels, temperatures = np.broadcast_arrays(
+            np.asarray(fermi_level, dtype=float), np.asarray(temperature, dtype=float))
+        errors = []
+        for band in ("vb", "cb"):
+            exponents = self._get_edge_exponents(band, fermi_levels, temperatures)
+            error = np.zeros(fermi_levels.shape)
+            if self.trim_kt:
+                for T in np.unique(temperatures):
+                    _, tail_moment, cut = self.get_band_window(band, T)
+                    points = (temperatures == T) & (exponents <= 0)
+                    error[points] = tail_moment * np.exp(2 * exponents[points] - cut)
+            errors.append(error / (self.volume * self.A_to_cm ** 3))
+        h_error, n_error = errors
+        if h_error.shape == ():
+            h_error, n_error = h_error[()], n_error[()]
+        return h_error, n_error
+
+    def get_boltzmann_moments(self, temperature):
+        """
+        Boltzmann moments of the valence and conduction band at a given temperature, 
+        sum(tdos * de * exp(-|E - E_edge|/kT)) over the states of the band. The carrier
+        density in the non-degenerate limit is the moment times exp(-|E_edge - fermi_level|/kT),
+        so the moments depend only on the temperature and are computed once and stored.
+
+        Args:
+            temperature: The temperature in Kelvin.
+
+        Returns:
+            Tuple with the moments of the valence and conduction band (states per cell).
+        """
+        if temperature not in self._boltzmann_moments:
+            kT = _cd("Boltzmann constant in eV/K") * temperature
+            vb_energies = self.energies[:self.idx_vbm + 1]
+            cb_energies = self.energies[self.idx_cbm:]
+            vb_moment = np.sum(self.tdos[:self.idx_vbm + 1] * self.de[:self.idx_vbm + 1]
+                               * np.exp((vb_energies - vb_energies[-1]) / kT))
+            cb_moment = np.sum(self.tdos[self.idx_cbm:] * self.de[self.idx_cbm:]
+                               * np.exp((cb_energies[0] - cb_energies) / kT))
+            self._boltzmann_moments[temperature] = (vb_moment, cb_moment)
+        return self._boltzmann_moments[temperature]
+
     def get_fermi_interextrapolated(self, concentration: float,
                                     temperature: float, warn: bool = True,
                                     c_ref: float = 1e10, **kwargs) -> float:
@@ -552,8 +763,9 @@ class FermiDosCarriersInfo(Dos, MSONable):
                 f1 = self.get_fermi_interextrapolated(
                     -max(10, abs(concentration) * 10.), temperature, warn=False,
                     **kwargs)
-                c2 = np.log(abs(1 + self.get_doping(f2, temperature)))
-                c1 = -np.log(abs(1 + self.get_doping(f1, temperature)))
+                d2, d1 = self.get_doping([f2, f1], temperature)
+                c2 = np.log(abs(1 + d2))
+                c1 = -np.log(abs(1 + d1))
                 slope = (f2 - f1) / (c2 - c1)
                 return f2 + slope * (np.sign(concentration) *
                                      np.log(abs(1 + concentration)) - c2)
@@ -572,13 +784,17 @@ class FermiDosCarriersInfo(Dos, MSONable):
                 return f_new + slope * (clog - c_newlog)
 
     def get_fermi(self, concentration: float, temperature: float,
-                  rtol: float = 0.01, nstep: int = 50, step: float = 0.1,
-                  precision: int = 8):
+                  rtol: float = 0.01, nstep: int = None, step: float = None,
+                  precision: int = None, xtol: float = 1e-10, maxiter: int = 100,
+                  get_stats: bool = False):
         """
         Finds the fermi level at which the doping concentration at the given
-        temperature (T) is equal to concentration. A greedy algorithm is used
-        where the relative error is minimized by calculating the doping at a
-        grid which continually becomes finer.
+        temperature (T) is equal to concentration. Since the doping is monotone
+        in the fermi level, the root is found with the bracketed Newton/bisection
+        solver of the charge neutrality (see neutrality.solve_neutrality) applied to
+        log(h + max(-concentration,0)) - log(|n| + max(concentration,0)), which is
+        almost linear in the fermi level. The carrier concentrations are evaluated
+        in log scale, the bracket is the energy range of the dos.
 
         Args:
             concentration: The doping concentration in 1/cm^3. Negative values
@@ -586,30 +802,58 @@ class FermiDosCarriersInfo(Dos, MSONable):
                 doping.
             temperature: The temperature in Kelvin.
             rtol: The maximum acceptable relative error.
-            nstep: THe number of steps checked around a given fermi level.
-            step: Initial step in energy when searching for the Fermi level.
-            precision: Essentially the decimal places of calculated Fermi level.
+            nstep, step, precision: Deprecated, parameters of the former grid search. 
+                They are ignored, use xtol and maxiter instead.
+            xtol: Absolute tolerance on the fermi level in eV.
+            maxiter: Maximum number of iterations of the solver.
+            get_stats: If True a dict with the iteration statistics of the solver 
+                is also returned.
 
         Returns:
             The fermi level in eV.. Note that this is different from the default
             dos.efermi.
         """
-        fermi = self.efermi  # initialize target fermi
-        relative_error = [float("inf")]
-        for _ in range(precision):
-            frange = np.arange(-nstep, nstep + 1) * step + fermi
-            calc_doping = np.array([self.get_doping(f, temperature)
-                                    for f in frange])
-            relative_error = np.abs(calc_doping / concentration - 1.0)
-            fermi = frange[np.argmin(relative_error)]
-            step /= 10.0
-
-        if min(relative_error) > rtol:
+        if nstep is not None or step is not None or precision is not None:
+            warnings.warn("nstep, step and precision are deprecated and ignored by get_fermi, "
+                          "use xtol and maxiter instead", DeprecationWarning, stacklevel=2)
+        vbm, band_arrays = self._get_band_arrays()
+        log_concentration = np.log(abs(concentration)) if concentration else -np.inf
+        log_doping = np.array([log_concentration if concentration < 0 else -np.inf,
+                               log_concentration if concentration > 0 else -np.inf])
+
+        def _get_log_charges(fermi_level):
+            log_carriers, dlog_carriers = get_carriers_log_charge(
+                band_arrays, np.array([fermi_level]), np.array([temperature]))
+            log_charges = np.logaddexp(log_carriers[0], log_doping)
+            return log_charges, dlog_carriers[0] * np.exp(log_carriers[0] - log_charges)
+
+        try:
+            fermi, stats = solve_neutrality(_get_log_charges, self.energies[0] - vbm,
+                                            self.energies[-1] - vbm, xtol=xtol, maxiter=maxiter)
+        except ValueError:
+            raise ValueError(
+                "Could not find fermi for concentration={}, outside the range of the dos".format(
+                    concentration))
+        fermi += vbm
+
+        relative_error = abs(self.get_doping(fermi, temperature) / concentration - 1.0)
+        if relative_error > rtol:
             raise ValueError(
                 "Could not find fermi within {}% of concentration={}".format(
                     rtol * 100, concentration))
+        if get_stats:
+            return fermi, stats
         return fermi
 
+    def _get_band_arrays(self):
+        """
+        Vbm and band arrays used to evaluate the carrier concentrations in log scale 
+        (see neutrality.get_band_arrays), computed once.
+        """
+        if self._band_arrays is None:
+            self._band_arrays = (self.get_cbm_vbm()[1], get_band_arrays(self))
+        return self._band_arrays
+
     @classmethod
     def from_dict(cls, d):
         """
@@ -632,6 +876,79 @@ class FermiDosCarriersInfo(Dos, MSONable):
                 "structure": self.structure, "nelecs": self.nelecs}
 
 
+# process-wide LRU cache of FermiDosCarriersInfo objects, see get_fermi_dos()
+_fermi_dos_cache = OrderedDict()
+fermi_dos_cache_size = 16
+
+
+def get_dos_hash(dos, structure=None):
+    """
+    Hash of the content of a Dos object (efermi, energies, densities and structure),
+    used to identify the same DOS also when the object is copied or reloaded.
+
+    Args:
+        dos: Pymatgen Dos object.
+        structure: Structure, if not provided the structure of the dos is used if present.
+
+    Returns:
+        Hexadecimal digest (str).
+    """
+    structure = structure or getattr(dos, "structure", None)
+    sha = hashlib.sha1()
+    sha.update(np.float64(dos.efermi).tobytes())
+    sha.update(np.asarray(dos.energies, dtype=float).tobytes())
+    for spin in sorted(dos.densities, key=lambda spin: int(spin)):
+        sha.update(str(int(spin)).encode())
+        sha.update(np.asarray(dos.densities[spin], dtype=float).tobytes())
+    if structure is not None:
+        sha.update(np.asarray(structure.lattice.matrix, dtype=float).tobytes())
+        sha.update(np.asarray(structure.frac_coords, dtype=float).tobytes())
+        sha.update(" ".join(str(sp) for sp in structure.species).encode())
+    return sha.hexdigest()
+
+
+def get_fermi_dos(dos, structure=None, nelecs=None, bandgap=None, boltzmann_rtol=None,
+                  trim_kt=None):
+    """
+    FermiDosCarriersInfo object from a process-wide LRU cache keyed on (content hash of 
+    the dos, bandgap, nelecs), such that the same bulk DOS is normalized and scissored only 
+    once across calls and objects. The cache holds at most fermi_dos_cache_size objects. 
+    The returned object is shared and should not be modified.
+
+    Args:
+        dos: Pymatgen Dos object.
+        structure, nelecs, bandgap, boltzmann_rtol, trim_kt: See FermiDosCarriersInfo.
+
+    Returns:
+        FermiDosCarriersInfo object.
+    """
+    key = (get_dos_hash(dos, structure), bandgap, nelecs, boltzmann_rtol, trim_kt)
+    if key in _fermi_dos_cache:
+        _fermi_dos_cache.move_to_end(key)
+        return _fermi_dos_cache[key]
+    fdos = FermiDosCarriersInfo(dos, structure=structure, nelecs=nelecs, bandgap=bandgap,
+                                boltzmann_rtol=boltzmann_rtol, trim_kt=trim_kt)
+    _fermi_dos_cache[key] = fdos
+    while len(_fermi_dos_cache) > fermi_dos_cache_size:
+        _fermi_dos_cache.popitem(last=False)
+    return fdos
+
+
+def clear_fermi_dos_cache(dos=None, structure=None):
+    """
+    Remove objects from the cache of get_fermi_dos(). If dos is provided only the objects
+    built from a DOS with the same content are removed, otherwise the cache is emptied.
+    A DOS modified in place has a different hash, the objects built before the modification 
+    are not returned anymore and are evicted when the cache is full.
+    """
+    if dos is None:
+        _fermi_dos_cache.clear()
+    else:
+        dos_hash = get_dos_hash(dos, structure)
+        for key in [key for key in _fermi_dos_cache if key[0] == dos_hash]:
+            del _fermi_dos_cache[key]
+
+
 class CompleteDos(Dos):
     """
     This wrapper class defines a total dos, and also provides a list of PDos.
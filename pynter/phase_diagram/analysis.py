@@ -2,12 +2,14 @@
 import json
 import os.path as op
 import numpy as np
+from monty.json import MontyEncoder, MontyDecoder
 from pandas import DataFrame
 import matplotlib.pyplot as plt
 from pymatgen.core.periodic_table import Element
 from pymatgen.core.composition import Composition
 from pymatgen.analysis.phase_diagram import PDEntry, PhaseDiagram, GrandPotentialPhaseDiagram, PDPlotter
 from pynter.tools.format import format_composition
+from pynter.tools.utils import load_npz, save_npz, split_arrays_from_dict, merge_arrays_in_dict
 
 class Reservoirs:
     
@@ -107,6 +109,44 @@ class Reservoirs:
             return d.__str__()  
 
 
+    def to_npz(self,path):
+        """
+        Save Reservoirs object in a binary .npz file. Chemical potentials are stored as a
+        matrix (reservoirs x elements), the conversion to the json format is lossless.
+
+        Parameters
+        ----------
+        path : (str)
+            Path to the destination file.
+        """
+        elements = []
+        for chempots in self.res_dict.values():
+            for el in chempots:
+                if el not in elements:
+                    elements.append(el)
+        chempots_array = np.zeros((len(self.res_dict),len(elements)))
+        chempots_mask = np.zeros((len(self.res_dict),len(elements)),dtype=bool)
+        for i,chempots in enumerate(self.res_dict.values()):
+            for el,mu in chempots.items():
+                chempots_array[i,elements.index(el)] = mu
+                chempots_mask[i,elements.index(el)] = True
+        
+        # PhaseDiagram dict can contain numpy arrays and pymatgen objects
+        d = json.loads(json.dumps(self.phase_diagram.as_dict(),cls=MontyEncoder)) if self.phase_diagram else None
+        d, arrays = split_arrays_from_dict(d)
+        arrays.update({'chempots':chempots_array,'chempots_mask':chempots_mask})
+        metadata = {
+            '@module':self.__class__.__module__,
+            '@class':self.__class__.__name__,
+            'reservoirs':list(self.res_dict.keys()),
+            'elements':[el.symbol for el in elements],
+            'phase_diagram':d,
+            'are_chempots_delta':self.are_chempots_delta
+            }
+        save_npz(path,arrays,metadata)
+        return
+
+
     @classmethod
     def from_dict(cls,d):
         """
@@ -153,6 +193,31 @@ class Reservoirs:
         return Reservoirs.from_dict(d)
 
 
+    @staticmethod
+    def from_npz(path):
+        """
+        Build Reservoirs object from a binary .npz file generated with to_npz().
+
+        Parameters
+        ----------
+        path : (str)
+            Path to the .npz file.
+
+        Returns
+        -------
+        Reservoir object.
+        """
+        arrays, metadata = load_npz(path,mmap=False)
+        elements = [Element(el) for el in metadata['elements']]
+        res_dict = {}
+        for res,chempots,mask in zip(metadata['reservoirs'],arrays['chempots'].tolist(),arrays['chempots_mask']):
+            res_dict[res] = {el:mu for el,mu,present in zip(elements,chempots,mask) if present}
+        d = merge_arrays_in_dict(metadata['phase_diagram'],arrays)
+        phase_diagram = MontyDecoder().process_decoded(d) if d else None
+        
+        return Reservoirs(res_dict,phase_diagram,metadata['are_chempots_delta'])
+
+
     def get_referenced_chempots(self):
         """ 
         Convert values of chempots from absolute to referenced 
@@ -10,6 +10,9 @@ import re
 import os
 import os.path as op
 import json
+import struct
+import zipfile
+import numpy as np
 
 
 def change_file (input_file , output_file=None, back_up_file = True,
@@ -118,6 +121,255 @@ def save_object_as_json(object,path):
         return d.__str__() 
 
 
+def save_npz(path,arrays,metadata={}):
+    """
+    Save NumPy arrays and json-serializable metadata in an uncompressed .npz file.
+    Arrays can be memory-mapped when loading with load_npz().
+
+    Parameters
+    ----------
+    path : (str)
+        Path to the destination file.
+    arrays : (dict)
+        Dictionary with names as keys and NumPy arrays as values. Arrays of objects are not allowed.
+    metadata : (dict)
+        Json-serializable dictionary, stored as a string in the "_metadata" array.
+    """
+    arrays = {key:np.asarray(array) for key,array in arrays.items()}
+    for key,array in arrays.items():
+        if array.dtype.hasobject:
+            raise ValueError(f'Array "{key}" contains python objects and cannot be saved without pickle')
+    np.savez(path,_metadata=np.array(json.dumps(metadata)),**arrays)
+    return
+
+
+def load_npz(path,mmap=True):
+    """
+    Load arrays and metadata saved with save_npz().
+
+    Parameters
+    ----------
+    path : (str)
+        Path to the .npz file.
+    mmap : (bool)
+        Memory-map the numeric arrays in read-only mode instead of reading them, such that data
+        is read from disk only when accessed. The default is True.
+
+    Returns
+    -------
+    arrays : (dict)
+        Dictionary with names as keys and NumPy arrays as values.
+    metadata : (dict)
+        Dictionary with metadata.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path,'rb') as file:
+        for info in archive.infolist():
+            key = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            array = None
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                # the member is stored as is, the array data starts after the zip and npy headers
+                file.seek(info.header_offset)
+                name_length, extra_length = struct.unpack('<HH',file.read(30)[26:30])
+                file.seek(info.header_offset + 30 + name_length + extra_length)
+                version = np.lib.format.read_magic(file)
+                if version == (1,0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+                if dtype.kind in 'biuf' and int(np.prod(shape)) > 0:
+                    array = np.memmap(path,dtype=dtype,mode='r',offset=file.tell(),shape=shape,
+                                      order='F' if fortran_order else 'C')
+            if array is None:
+                with archive.open(info) as member:
+                    array = np.lib.format.read_array(member,allow_pickle=False)
+            arrays[key] = array
+            
+    metadata = json.loads(str(arrays.pop('_metadata'))) if '_metadata' in arrays else {}
+    return arrays, metadata
+
+
+def split_arrays_from_dict(d,min_size=16):
+    """
+    Replace the lists of numbers in a json-serializable dictionary with references to NumPy arrays.
+    Only lists with all int or all float values are converted, such that the dictionary
+    can be rebuilt exactly with merge_arrays_in_dict().
+
+    Parameters
+    ----------
+    d : (dict)
+        Json-serializable dictionary.
+    min_size : (int)
+        Minimum length of the lists to convert. The default is 16.
+
+    Returns
+    -------
+    d_new : (dict)
+        Dictionary with lists replaced by {"@array":key}.
+    arrays : (dict)
+        Dictionary with keys and arrays.
+    """
+    arrays = {}
+    def _split(value):
+        if isinstance(value,dict):
+            return {k:_split(v) for k,v in value.items()}
+        elif isinstance(value,list):
+            if len(value) >= min_size:
+                for number_type in (float,int):
+                    if all(type(v) is number_type for v in value):
+                        key = f'array_{len(arrays)}'
+                        arrays[key] = np.array(value,dtype=number_type)
+                        return {'@array':key}
+            return [_split(v) for v in value]
+        else:
+            return value
+    
+    return _split(d), arrays
+
+
+def merge_arrays_in_dict(d,arrays):
+    """
+    Rebuild the dictionary generated with split_arrays_from_dict().
+    """
+    def _merge(value):
+        if isinstance(value,dict):
+            if len(value) == 1 and '@array' in value:
+                return arrays[value['@array']].tolist()
+            return {k:_merge(v) for k,v in value.items()}
+        elif isinstance(value,list):
+            return [_merge(v) for v in value]
+        else:
+            return value
+    
+    return _merge(d)
+
+
+def get_object_from_npz(cls,path):
+    """
+    Build class object from .npz file generated with save_object_as_npz(). 
+    The class must posses the 'from_dict' method.
+
+    Parameters
+    ----------
+    cls : (class)
+    path : (str)
+        Path to the .npz file.
+    """
+    arrays, d = load_npz(path,mmap=False)
+    return cls.from_dict(merge_arrays_in_dict(d,arrays))
+
+
+def save_object_as_npz(object,path):
+    """
+    Save class object as binary .npz file. The class must posses the 'as_dict' method.
+    Lists of numbers in the dict are stored as binary arrays, the rest as json metadata.
+    The conversion to the json dictionary is lossless.
+
+    Parameters
+    ----------
+    object: object of a class
+    path : (str)
+        Path to the destination file.
+    """
+    d, arrays = split_arrays_from_dict(object.as_dict())
+    save_npz(path,arrays,d)
+    return
+
+
+def iter_json_object(file,stream_keys=[],chunk_size=2**20):
+    """
+    Read a JSON object from a file in chunks, such that the whole file is never loaded in memory.
+    The items of the object are yielded one at a time. For the keys in stream_keys whose value is a 
+    list, the elements of the list are yielded one at a time with the same key.
+
+    Parameters
+    ----------
+    file : (file object)
+        Opened text file (or file-like object) containing a JSON object.
+    stream_keys : (list)
+        Keys of the lists whose elements are yielded one by one.
+    chunk_size : (int)
+        Number of characters read from the file every time the buffer is refilled. The default is 2**20.
+
+    Yields
+    ------
+    key : (str)
+        Key of the item in the JSON object.
+    value : 
+        Value of the item, or single element of the list for keys in stream_keys.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    
+    def _read(size):
+        nonlocal buffer, position, eof
+        chunk = file.read(size)
+        if not chunk:
+            eof = True
+        # parsed part of the buffer is dropped
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def _next_char():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\n\r':
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                raise ValueError('Unexpected end of JSON file')
+            _read(chunk_size)
+    
+    def _decode():
+        nonlocal position
+        _next_char()
+        size = chunk_size
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer,position)
+                # a value at the end of the buffer could be truncated (e.g. numbers)
+                if end < len(buffer) or eof:
+                    position = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            _read(size)
+            size *= 2 # avoid parsing many times values larger than the chunk size
+
+    if _next_char() != '{':
+        raise ValueError('JSON file does not contain an object')
+    position += 1
+    while True:
+        char = _next_char()
+        if char == '}':
+            return
+        elif char == ',':
+            position += 1
+            continue
+        
+        key = _decode()
+        if _next_char() != ':':
+            raise ValueError(f'Expected ":" after key "{key}" in JSON file')
+        position += 1
+        if key in stream_keys and _next_char() == '[':
+            position += 1
+            while True:
+                char = _next_char()
+                if char == ']':
+                    position += 1
+                    break
+                elif char == ',':
+                    position += 1
+                    continue
+                yield key, _decode()
+        else:
+            yield key, _decode()
+
+
 
 def grep(search_string,file):    
     '''